@@ -0,0 +1,191 @@
+import argparse
+import sqlite3
+import csv
+from datetime import datetime
+
+# speed and projection reports over the snapshots of the history database (see Scraper.recordSnapshot and Scraper.watch)
+# numpy is only needed by this module and is imported when used (pip install numpy). usage: python analytics.py --help
+
+def loadNumpy(): # numpy is an optional dependency
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        raise ImportError("The reports need numpy, install it with: pip install numpy")
+
+class Series(): # the full snapshots of a ranking as (entities x snapshots) arrays of points and ranks, nan where an entity isn't in a snapshot
+    # the watch polls only cover a few entities every few minutes, they are kept apart as rows (see border and history) instead of adding a column for everyone
+    def __init__(self, history_file : str, gw : int, crew : bool = True):
+        np = loadNumpy()
+        self.np = np
+        kind = 0 if crew else 1
+        conn = sqlite3.connect(history_file)
+        data = self.load(conn, 'SELECT s.ts, e.id, e.point, e.rank FROM entries e JOIN snapshots s ON s.snapshot = e.snapshot WHERE s.gw = ? AND s.kind = ?', (gw, kind))
+        self.polls = np.empty((0, 4), dtype=np.int64) # ts, id, point, rank of the watch polls, by id then time
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'watch'").fetchone() is not None:
+            self.polls = self.load(conn, 'SELECT ts, id, point, rank FROM watch WHERE gw = ? AND kind = ?', (gw, kind))
+            self.polls = self.polls[np.lexsort((self.polls[:, 0], self.polls[:, 1]))]
+        self.names = dict(conn.execute('SELECT id, name FROM entities WHERE kind = ?', (kind,)).fetchall())
+        conn.close()
+        if len(data) == 0 and len(self.polls) == 0: raise Exception("No GW{} {} snapshot in '{}'".format(gw, 'crew' if crew else 'player', history_file))
+        self.ts, col = np.unique(data[:, 0], return_inverse=True)
+        self.ids, row = np.unique(data[:, 1], return_inverse=True)
+        self.points = np.full((len(self.ids), len(self.ts)), np.nan)
+        self.points[row, col] = data[:, 2]
+        self.ranks = np.full((len(self.ids), len(self.ts)), np.nan)
+        self.ranks[row, col] = data[:, 3]
+        data = None
+        self.start = min(np.concatenate([self.ts[:1], self.polls[:, 0]])) # time of the first data, hour 0
+        self.hours = self.hoursOf(self.ts)
+        self.end = self.hoursOf(max(np.concatenate([self.ts[-1:], self.polls[:, 0]]))) # hour of the last data, snapshot or poll
+
+    def load(self, conn, query : str, params : tuple): # rows of a query as an int64 array, read by chunks (a list of tuples of the whole player history would be huge)
+        np = self.np
+        cursor = conn.execute(query, params)
+        chunks = [np.empty((0, 4), dtype=np.int64)]
+        while True:
+            rows = cursor.fetchmany(100000)
+            if len(rows) == 0: break
+            chunks.append(np.array(rows, dtype=np.int64))
+        return np.concatenate(chunks)
+
+    def hoursOf(self, ts): # timestamps to hours since the first data
+        return (ts - self.start) / 3600
+
+    def filled(self): # points and their time (in hours) carried forward over the snapshots an entity is missing from
+        np = self.np
+        index = np.where(np.isnan(self.points), 0, np.arange(len(self.ts)))
+        index = np.maximum.accumulate(index, axis=1)
+        return np.take_along_axis(self.points, index, axis=1), self.hours[index]
+
+    def intervals(self): # speed of every entity between two consecutive snapshots, in points per hour
+        return self.np.diff(self.points, axis=1) / self.np.diff(self.hours)
+
+    def rate(self, window : float): # speed of every entity over the last window hours (from its last value before the window)
+        np = self.np
+        points, hours = self.filled()
+        j = max(0, int(np.searchsorted(self.hours, self.hours[-1] - window, side='right')) - 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = (points[:, -1] - points[:, j]) / (hours[:, -1] - hours[:, j])
+        return np.where(np.isfinite(r), r, np.nan)
+
+    def average(self): # speed of every entity from its first to its last snapshot
+        np = self.np
+        present = ~np.isnan(self.points)
+        first = np.argmax(present, axis=1)
+        last = len(self.ts) - 1 - np.argmax(present[:, ::-1], axis=1)
+        rows = np.arange(len(self.ids))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = (self.points[rows, last] - self.points[rows, first]) / (self.hours[last] - self.hours[first])
+        return np.where(np.isfinite(r), r, np.nan)
+
+    def current(self): # last known points and rank of every entity
+        np = self.np
+        points, hours = self.filled()
+        index = np.maximum.accumulate(np.where(np.isnan(self.ranks), 0, np.arange(len(self.ts))), axis=1)[:, -1]
+        return points[:, -1], self.ranks[np.arange(len(self.ids)), index]
+
+    def border(self, rank : int): # hours and points of the snapshots and the watch polls where somebody was recorded at this rank, in time order
+        np = self.np
+        at = self.ranks == rank
+        found = at.any(axis=0)
+        polled = self.polls[self.polls[:, 3] == rank]
+        ts = np.concatenate([self.ts[found], polled[:, 0]])
+        points = np.concatenate([np.where(at[:, found], self.points[:, found], 0).sum(axis=0), polled[:, 2]])
+        ts, first = np.unique(ts, return_index=True) # a poll at the time of a snapshot is only counted once
+        return self.hoursOf(ts), points[first]
+
+    def history(self, id : int): # timestamps, points and ranks of an entity in the snapshots and the watch polls, in time order
+        np = self.np
+        i = min(int(np.searchsorted(self.ids, id)), len(self.ids) - 1)
+        known = ~np.isnan(self.points[i]) if len(self.ids) > 0 and self.ids[i] == id else np.zeros(len(self.ts), dtype=bool)
+        lo, hi = np.searchsorted(self.polls[:, 1], [id, id + 1])
+        polled = self.polls[lo:hi]
+        ts = np.concatenate([self.ts[known], polled[:, 0]])
+        points = np.concatenate([self.points[i, known] if known.any() else [], polled[:, 2]])
+        ranks = np.concatenate([self.ranks[i, known] if known.any() else [], polled[:, 3]])
+        ts, first = np.unique(ts, return_index=True)
+        return ts, points[first], ranks[first]
+
+    def project(self, hours_left : float, window : float): # final points of every entity if it keeps its speed of the last window hours. hours_left counts from the last data, a watch poll can be more recent than the last snapshot
+        return self.current()[0] + self.rate(window) * (hours_left + self.end - self.hours[-1])
+
+def fmt(value): # csv cell of a number, 'n/a' for nan
+    return 'n/a' if value != value else int(round(value))
+
+def writeSpeeds(series : Series, name : str, window : float, hours_left : float = None): # one row per entity, by rank
+    np = series.np
+    points, ranks = series.current()
+    last = series.intervals()[:, -1] if len(series.ts) > 1 else np.full(len(series.ids), np.nan)
+    rate = series.rate(window)
+    average = series.average()
+    projected = series.project(hours_left, window) if hours_left is not None else None
+    j = max(0, int(np.searchsorted(series.hours, series.hours[-1] - window, side='right')) - 1)
+    change = series.ranks[:, j] - ranks # positive when climbing
+    order = np.lexsort((series.ids, np.where(np.isnan(ranks), np.inf, ranks)))
+    with open(name, 'w', newline='', encoding="utf-8") as csvfile:
+        llwriter = csv.writer(csvfile, delimiter=',', quotechar='"', lineterminator='\n', quoting=csv.QUOTE_NONNUMERIC)
+        llwriter.writerow(["rank", "id", "name", "points", "speed (last interval)", "speed ({}h)".format(window), "average speed", "rank change ({}h)".format(window)] + (["projected"] if projected is not None else []))
+        for i in order:
+            id = int(series.ids[i])
+            llwriter.writerow([fmt(ranks[i]), id, series.names.get(id, ''), fmt(points[i]), fmt(last[i]), fmt(rate[i]), fmt(average[i]), fmt(change[i])] + ([fmt(projected[i])] if projected is not None else []))
+
+def writeBorders(series : Series, name : str, borders : list, window : float, hours_left : float = None): # one row per border rank
+    np = series.np
+    projected = []
+    if hours_left is not None and len(series.ts) > 0: # the border among the projected finals of everyone, needs a full snapshot
+        projected = series.project(hours_left, window)
+        projected = -np.sort(-projected[~np.isnan(projected)])
+    with open(name, 'w', newline='', encoding="utf-8") as csvfile:
+        llwriter = csv.writer(csvfile, delimiter=',', quotechar='"', lineterminator='\n', quoting=csv.QUOTE_NONNUMERIC)
+        llwriter.writerow(["border", "points", "speed ({}h)".format(window), "average speed"] + (["projected (border speed)", "projected (rankings speeds)"] if hours_left is not None else []))
+        for b in borders:
+            hours, cutoff = series.border(b)
+            if len(hours) == 0:
+                llwriter.writerow([b] + ['n/a'] * (5 if hours_left is not None else 3))
+                continue
+            last = len(hours) - 1
+            j = max(0, np.searchsorted(hours, hours[last] - window, side='right') - 1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                rate = (cutoff[last] - cutoff[j]) / (hours[last] - hours[j]) if last != j else np.nan
+                average = (cutoff[last] - cutoff[0]) / (hours[last] - hours[0]) if last != 0 else np.nan
+            row = [b, fmt(cutoff[last]), fmt(rate), fmt(average)]
+            if hours_left is not None:
+                row.append(fmt(cutoff[last] + rate * (hours_left + series.end - hours[last])))
+                row.append(fmt(projected[b-1]) if b <= len(projected) else 'n/a')
+            llwriter.writerow(row)
+
+def writeTrajectories(series : Series, name : str, ids : list): # rank, points and speed of the given entities in every snapshot and watch poll they are in
+    with open(name, 'w', newline='', encoding="utf-8") as csvfile:
+        llwriter = csv.writer(csvfile, delimiter=',', quotechar='"', lineterminator='\n', quoting=csv.QUOTE_NONNUMERIC)
+        llwriter.writerow(["time", "id", "name", "rank", "points", "speed"])
+        for id in ids:
+            ts, points, ranks = series.history(int(id))
+            for j in range(len(ts)):
+                speed = (points[j] - points[j-1]) / ((ts[j] - ts[j-1]) / 3600) if j > 0 else float('nan') # since its previous data
+                llwriter.writerow([datetime.fromtimestamp(int(ts[j])).strftime("%Y-%m-%d %H:%M"), int(id), series.names.get(int(id), ''), fmt(ranks[j]), fmt(points[j]), fmt(speed)])
+
+def report(gw : int, crew : bool = True, history_file : str = 'history.sql', window : float = 1.0, hours_left : float = None, borders : list = None, ids : list = None): # write the speed, border and trajectory reports of a ranking. return the file names
+    series = Series(history_file, gw, crew)
+    kind = 'crew' if crew else 'player'
+    names = ['GW{}_{}_speeds.csv'.format(gw, kind), 'GW{}_{}_borders.csv'.format(gw, kind)]
+    if len(series.ts) > 0: writeSpeeds(series, names[0], window, hours_left) # needs a full snapshot
+    else: names.pop(0)
+    writeBorders(series, names[-1], borders or [1000, 2000, 3000, 5000, 10000], window, hours_left)
+    if ids:
+        names.append('GW{}_{}_trajectories.csv'.format(gw, kind))
+        writeTrajectories(series, names[-1], ids)
+    return names
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Speed and projection reports from the history database")
+    parser.add_argument('gw', type=int)
+    parser.add_argument('--player', action='store_true', help="player ranking instead of the crew ranking")
+    parser.add_argument('--history', default='history.sql', help="history database")
+    parser.add_argument('--window', type=float, default=1.0, help="hours used for the recent speeds")
+    parser.add_argument('--hours-left', type=float, help="hours until the end of the GW, to project the finals")
+    parser.add_argument('--borders', type=int, nargs='*', help="border ranks")
+    parser.add_argument('--ids', nargs='*', help="crews or players to include in the trajectory report")
+    args = parser.parse_args()
+    for name in report(args.gw, not args.player, args.history, args.window, args.hours_left, args.borders, args.ids):
+        print("{}: Done".format(name))
@@ -0,0 +1,130 @@
+from mockserver import MockServer
+import multiprocessing
+import contextlib
+import argparse
+import tempfile
+import json
+import time
+import sys
+import os
+try: import resource # not available on Windows
+except ImportError: resource = None
+
+# throughput benchmark of the scraper against the local stand-in server (mockserver.py)
+# every case runs in its own process, for a clean peak RSS. usage: python benchmark.py --help
+
+CASES = {
+    'crew-thread': ('thread', 1),
+    'crew-async': ('async', 1),
+    'player-thread': ('thread', 2),
+    'player-async': ('async', 2),
+    'gbfg': (None, None),
+}
+
+def percentile(values : list, p : float):
+    if len(values) == 0: return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def peakRSS(): # in MB
+    if resource is None: return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024 # bytes on macOS, KB on Linux
+
+def serve(options, queue): # mock server process
+    mock = MockServer(0, **options)
+    queue.put(mock.start())
+    while True: time.sleep(3600)
+
+def timed(func, latencies): # wrap a request method to record its latency
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try: return func(*args, **kwargs)
+        finally: latencies.append(time.perf_counter() - start)
+    return wrapper
+
+def timedAsync(func, latencies):
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try: return await func(*args, **kwargs)
+        finally: latencies.append(time.perf_counter() - start)
+    return wrapper
+
+def runCase(name, host, gw, max_threads, accounts, queue): # benchmark process
+    from gwscrap import Scraper, rankingFile, readRanking
+    engine, mode = CASES[name]
+    latencies = []
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        with open('config.json', 'w') as f:
+            json.dump([{'id':i+1, 'cookie':'midship=0; wing=0', 'user_agent':'benchmark'} for i in range(accounts)], f)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            scraper = Scraper(gw, host)
+            scraper.history_file = None # only the scraping is measured
+            scraper.max_threads = max_threads
+            scraper.requestRanking = timed(scraper.requestRanking, latencies)
+            scraper.requestRankingAsync = timedAsync(scraper.requestRankingAsync, latencies)
+            scraper.requestCrew = timed(scraper.requestCrew, latencies)
+            start = time.perf_counter()
+            if engine is None:
+                ok = scraper.downloadGbfg()
+            else:
+                scraper.engine = engine
+                ok = scraper.run(mode, False)
+            elapsed = time.perf_counter() - start
+        if ok is False: pages = 0 # reported as 0 pages/s, instead of leaving the main process waiting
+        elif engine is None: pages = len(latencies)
+        else: pages = (sum(1 for r in readRanking(rankingFile('GW{}_{}'.format(gw, 'crew' if mode == 1 else 'player')))) + 9) // 10
+        os.chdir(os.path.dirname(folder))
+    queue.put({'case':name, 'pages':pages, 'requests':len(latencies), 'elapsed':elapsed, 'pages_per_sec':pages / elapsed, 'p50_ms':percentile(latencies, 50) * 1000, 'p99_ms':percentile(latencies, 99) * 1000, 'peak_rss_mb':peakRSS()})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scraper throughput benchmark against the local mock server")
+    parser.add_argument('cases', nargs='*', default=list(CASES.keys()), help="cases to run: {}".format(", ".join(CASES.keys())))
+    parser.add_argument('--gw', type=int, default=1)
+    parser.add_argument('--crews', type=int, default=5000)
+    parser.add_argument('--players', type=int, default=50000)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.01)
+    parser.add_argument('--rate-limit', type=int, default=0, help="requests per second and per account")
+    parser.add_argument('--threads', type=int, default=100, help="Scraper.max_threads")
+    parser.add_argument('--accounts', type=int, default=1, help="number of accounts in config.json")
+    parser.add_argument('--save', help="write the results to this json file")
+    parser.add_argument('--compare', help="json file of a previous run, exit with an error if pages/s dropped by more than the tolerance")
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+    for c in args.cases:
+        if c not in CASES: parser.error("unknown case '{}'".format(c))
+
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    server = ctx.Process(target=serve, args=({'crews':args.crews, 'players':args.players, 'latency':args.latency, 'error_rate':args.error_rate, 'rate_limit':args.rate_limit}, queue), daemon=True)
+    server.start()
+    host = queue.get()
+    print("Mock server on", host)
+    results = []
+    print("{:<14} {:>7} {:>9} {:>9} {:>11} {:>9} {:>9} {:>9}".format("case", "pages", "requests", "time (s)", "pages/s", "p50 (ms)", "p99 (ms)", "RSS (MB)"))
+    for c in args.cases:
+        p = ctx.Process(target=runCase, args=(c, host, args.gw, args.threads, args.accounts, queue))
+        p.start()
+        r = queue.get()
+        p.join()
+        results.append(r)
+        print("{case:<14} {pages:>7} {requests:>9} {elapsed:>9.2f} {pages_per_sec:>11.1f} {p50_ms:>9.1f} {p99_ms:>9.1f} {rss:>9}".format(rss='n/a' if r['peak_rss_mb'] is None else '{:.1f}'.format(r['peak_rss_mb']), **r))
+    server.terminate()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            previous = {r['case']:r for r in json.load(f)}
+        regression = False
+        for r in results:
+            if r['case'] not in previous: continue
+            change = r['pages_per_sec'] / previous[r['case']]['pages_per_sec'] - 1
+            print("{:<14} {:+.1%} pages/s".format(r['case'], change))
+            if change < -args.tolerance: regression = True
+        if regression:
+            print("Regression detected")
+            sys.exit(1)
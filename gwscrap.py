@@ -1,54 +1,878 @@
 ﻿from datetime import datetime, timezone
-import httpx
 import json
+import gzip
+import zlib
 import time
 import re
-from threading import Lock
+import random
+from threading import Lock, Condition, Thread, Event
+import functools
+import argparse
 import concurrent.futures
+import multiprocessing
 from queue import Queue
 import signal
+import sys
 import sqlite3
 import csv
+import hashlib
+import mmap
+import struct
+import bisect
+from array import array
 import os
 from os import listdir
 from os.path import isfile, join
+from typing import NamedTuple
+
+def rankingFile(name : str): # return the path of a ranking file, whatever its format (.json, .ndjson, .ndjson.gz or .snap)
+    for ext in ['.json', '.ndjson', '.ndjson.gz', '.snap']:
+        if isfile(name + ext): return name + ext
+    raise FileNotFoundError("No such file: '{}.json'".format(name))
+
+def readRanking(path : str): # iterate over the rows of a ranking file, the ndjson ones are streamed line by line
+    if path.endswith('.json'):
+        with open(path) as f:
+            yield from json.load(f)
+    elif path.endswith('.snap'):
+        snap = Snapshot(path)
+        try: yield from snap.rows()
+        finally: snap.close()
+    else:
+        with (gzip.open(path, 'rt', encoding='utf-8') if path.endswith('.gz') else open(path, encoding='utf-8')) as f:
+            for line in f:
+                yield json.loads(line)
+
+def dayRows(name : str, crew : bool): # iterate over a day of a ranking, keeping only what buildGW needs: (id, point, name, level, rank, defeat)
+    for c in readRanking(rankingFile(name)):
+        if crew:
+            if 'id' in c: yield c['id'], int(c['point']), c['name'], None, c['ranking'], None
+        elif 'user_id' in c: yield c['user_id'], int(c['point']), c['name'], c['level'], c['rank'], c['defeat']
+
+def loadDay(name : str, crew : bool): # process pool worker of buildGW: the rows of a day as a list (cheaper to send back than a dict)
+    try: return list(dayRows(name, crew))
+    except Exception as e: return e # printed by buildGW
+
+class Member(NamedTuple): # a /gbfg/ crew member, used by the .csv builders
+    id: str
+    name: str # with ' (c)' for the captain
+    level: str
+    data: dict # compiled data from GW{n}_player_full.json, empty if the player isn't in it
+    guild: str = ''
+
+def rankBy(items : list, key, descending : bool = False, ties_reversed : bool = False): # sort items with a key function returning an int, or None for the unranked items. return (ranked, unranked), the unranked keep their original order
+    ranked = []
+    unranked = []
+    for it in (reversed(items) if ties_reversed else items): # ties_reversed: tied items come out in reverse order, like the old selection sort of the leechlists
+        k = key(it)
+        if k is None: unranked.append(it)
+        else: ranked.append((k, it))
+    ranked.sort(key=lambda x: x[0], reverse=descending) # stable, tied items keep their order
+    if ties_reversed: unranked.reverse()
+    return [it for k, it in ranked], unranked
+
+def crewMembers(crew : dict, players : dict): # return the Member records of a /gbfg/ crew
+    members = []
+    for p in crew['player']:
+        data = players.get(str(p['id']))
+        name = (p['name'] if data is None else data['name']) + (" (c)" if p['is_leader'] else "")
+        if data is None: members.append(Member(p['id'], name, p['level'], {}))
+        else: members.append(Member(str(p['id']), name, data['level'], data))
+    return members
+
+def memberHash(rows : list): # fingerprint of a member list page, to detect a roster change
+    return hashlib.md5(json.dumps(rows, sort_keys=True).encode('utf-8')).hexdigest()
+
+def dumpTime(name : str, mtime : float): # timestamp of a gbfg/ dump, from its name if it's one of ours, else its modification time
+    try: return datetime.strptime(name.rsplit('.', 1)[0], "%Y-%m-%d_%H-%M-%S").timestamp()
+    except ValueError: return mtime
+
+def crewCsvName(gw : int, crew : dict): # file name of the leechlist of a crew
+    remove_punctuation_map = dict((ord(char), None) for char in '\/*?:"<>|')
+    return "GW{}_{}.csv".format(gw, crew['name'].translate(remove_punctuation_map))
+
+def writeCrewCsv(gw : int, c : str, crew : dict, players : dict, temp : str = None, sort : bool = True): # write the leechlist of a crew, players only needs the crew members. run in a process pool by Scraper.writeCrewCsvs, return the file name
+    days = ['prelim', 'delta_d1', 'd1', 'delta_d2', 'd2', 'delta_d3', 'd3', 'delta_d4', 'd4']
+    members = crewMembers(crew, players)
+    if not sort: ranked, unranked = members, [] # ranked members get their full data, the others are written as 'n/a'
+    elif temp is None: ranked, unranked = rankBy(members, lambda m: int(m.data['rank']) if 'rank' in m.data else None, False, True) # sorted by rank
+    else: ranked, unranked = rankBy(members, lambda m: int(m.data[temp]) if temp in m.data else None, True, True) # sorted by points on the given day
+    name = crewCsvName(gw, crew)
+    with open(name, 'w', newline='', encoding="utf-8") as csvfile:
+        llwriter = csv.writer(csvfile, delimiter=',', quotechar='"', lineterminator='\n', quoting=csv.QUOTE_NONNUMERIC)
+        llwriter.writerow(["", "#", "id", "name", "rank", "battle", "preliminaries", "interlude & day 1", "total 1", "day 2", "total 2", "day 3", "total 3", "day 4", "total 4"])
+        total = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+        for i, m in enumerate(ranked):
+            llwriter.writerow([str(i+1), m.data.get('rank', 'n/a'), m.id, m.name.replace('"', '\\"'), m.level, m.data.get('defeat', 'n/a')] + [str(m.data.get(d, 'n/a')) for d in days]) # the points are ints in the compiled data, written as strings (quoted) like before
+            total[0] += int(m.level)
+            for j, d in enumerate(days):
+                total[j+1] += int(m.data.get(d, '0'))
+        for i, m in enumerate(unranked, len(ranked)):
+            llwriter.writerow([str(i+1), 'n/a', m.id, m.name.replace('"', '\\"'), m.level] + ['n/a'] * 10)
+            total[0] += int(m.level)
+        llwriter.writerow(['', '', '', 'average', str(total[0]//len(members)), '', '', '', '', '', '', '', '', '', ''])
+        llwriter.writerow(['', '', '', 'total', '', ''] + [str(t) for t in total[1:]])
+        llwriter.writerow(['', '', '', '', '', '', '', '', '', '', '', '', '', '', ''])
+        gname = crew['name'].replace('"', '\\"')
+        llwriter.writerow(['', 'guild', str(c), gname, '', '', '', '', '', '', '', '', '', '', ''])
+    return name
+
+class Metrics(): # counters, gauges and histograms recorded while the scraper runs, exported in json or prometheus text format
+    BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10, 30) # histogram upper bounds, in seconds
+
+    def __init__(self):
+        self.lock = Lock()
+        self.counters = {} # (name, labels) -> value
+        self.gauges = {} # (name, labels) -> value
+        self.histograms = {} # (name, labels) -> [bucket counts..., count, sum]
+
+    def inc(self, name : str, value = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name : str, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name : str, value : float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = [0] * (len(self.BUCKETS) + 2)
+                self.histograms[key] = h
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    h[i] += 1
+                    break
+            h[-2] += 1
+            h[-1] += value
+
+    def value(self, name : str, **labels): # current value of a counter
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def quantile(self, name : str, q : float, **labels): # estimated from the buckets (upper bound of the bucket holding the quantile)
+        h = self.histograms.get((name, tuple(sorted(labels.items()))))
+        if h is None or h[-2] == 0: return 0
+        n = 0
+        for i, bound in enumerate(self.BUCKETS):
+            n += h[i]
+            if n >= h[-2] * q: return bound
+        return float('inf')
+
+    def toJSON(self):
+        with self.lock:
+            res = []
+            for (name, labels), v in self.counters.items(): res.append({'name':name, 'labels':dict(labels), 'type':'counter', 'value':v})
+            for (name, labels), v in self.gauges.items(): res.append({'name':name, 'labels':dict(labels), 'type':'gauge', 'value':v})
+            for (name, labels), h in self.histograms.items():
+                res.append({'name':name, 'labels':dict(labels), 'type':'histogram', 'count':h[-2], 'sum':h[-1], 'p50':self.quantile(name, 0.5, **dict(labels)), 'p99':self.quantile(name, 0.99, **dict(labels)), 'buckets':{str(b):c for b, c in zip(self.BUCKETS, h)}})
+            return res
+
+    def toPrometheus(self):
+        def fmt(name, labels, extra = ()):
+            labels = list(labels) + list(extra)
+            if len(labels) == 0: return 'gwscrap_' + name
+            return 'gwscrap_{}{{{}}}'.format(name, ','.join('{}="{}"'.format(k, v) for k, v in labels))
+        lines = []
+        with self.lock:
+            for kind, values in [('counter', self.counters), ('gauge', self.gauges)]:
+                for name in sorted(set(k[0] for k in values)):
+                    lines.append('# TYPE gwscrap_{} {}'.format(name, kind))
+                    for (n, labels), v in values.items():
+                        if n == name: lines.append('{} {}'.format(fmt(name, labels), v))
+            for name in sorted(set(k[0] for k in self.histograms)):
+                lines.append('# TYPE gwscrap_{} histogram'.format(name))
+                for (n, labels), h in self.histograms.items():
+                    if n != name: continue
+                    total = 0
+                    for b, c in zip(self.BUCKETS, h):
+                        total += c
+                        lines.append('{} {}'.format(fmt(name + '_bucket', labels, [('le', b)]), total))
+                    lines.append('{} {}'.format(fmt(name + '_bucket', labels, [('le', '+Inf')]), h[-2]))
+                    lines.append('{} {}'.format(fmt(name + '_sum', labels), h[-1]))
+                    lines.append('{} {}'.format(fmt(name + '_count', labels), h[-2]))
+        return '\n'.join(lines) + '\n'
+
+def stage(func): # decorator for the Scraper pipeline stages: record their wall time and export the metrics once the outermost stage is over
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self.stage_lock: # stages can run concurrently (see Pipeline)
+            self.stage_depth += 1
+        start = time.perf_counter()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            self.metrics.observe('stage_seconds', time.perf_counter() - start, stage=func.__name__)
+            with self.stage_lock:
+                self.stage_depth -= 1
+                outermost = self.stage_depth == 0
+            if outermost: self.writeMetrics()
+    return wrapper
+
+class Pipeline(): # make-style scheduler of the build stages: a stage starts once the stages it depends on are over, concurrently with the independent ones, and is skipped if the content of its inputs didn't change since its last successful run. the stages depending on a failed one don't run
+    def __init__(self, path : str):
+        self.path = path # state file: hashes of the inputs of each stage at its last run
+        self.stages = {} # name -> (function, inputs, outputs, dependencies)
+        self.lock = Lock()
+        self.state = {'files':{}, 'stages':{}}
+
+    def add(self, name : str, func, inputs = None, outputs = (), after : list = ()): # inputs and outputs are lists of files, or functions returning them (for the folders). a stage without inputs always runs
+        self.stages[name] = (func, inputs, outputs, after)
+
+    def hash(self, path : str): # content hash of a file, only computed again if its size or modification time changed. None if it doesn't exist
+        try: st = os.stat(path)
+        except FileNotFoundError: return None
+        with self.lock:
+            known = self.state['files'].get(path)
+        if known is not None and known[0] == st.st_mtime and known[1] == st.st_size: return known[2]
+        h = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1048576), b''): h.update(chunk)
+        with self.lock:
+            self.state['files'][path] = [st.st_mtime, st.st_size, h.hexdigest()]
+        return h.hexdigest()
+
+    def runStage(self, name : str): # return 'done', 'skipped' or 'failed' and the wall time ('blocked' is set by run, see below)
+        func, inputs, outputs, after = self.stages[name]
+        start = time.time()
+        hashes = None
+        if inputs is not None:
+            hashes = {path:self.hash(path) for path in (inputs() if callable(inputs) else inputs)}
+            if hashes == self.state['stages'].get(name) and all(isfile(path) for path in (outputs() if callable(outputs) else outputs)):
+                return 'skipped', time.time() - start
+        try: ok = func() is not False and all(isfile(path) for path in (outputs() if callable(outputs) else outputs))
+        except Exception as e:
+            print('{}(): {}'.format(name, e))
+            ok = False
+        if ok and hashes is not None:
+            with self.lock: self.state['stages'][name] = hashes
+        elif not ok:
+            with self.lock: self.state['stages'].pop(name, None)
+        return ('done' if ok else 'failed'), time.time() - start
+
+    def run(self, workers : int = 4): # run all the stages. return name -> (status, wall time)
+        try:
+            with open(self.path) as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print('Pipeline.run(): ' + str(e))
+        results = {}
+        running = {}
+        start = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            while len(results) < len(self.stages):
+                for name, (func, inputs, outputs, after) in self.stages.items():
+                    if name in results or name in running.values() or not all(d in results for d in after): continue
+                    if any(results[d][0] in ['failed', 'blocked'] for d in after): # its inputs are stale or partial, it would be recorded as up to date
+                        with self.lock: self.state['stages'].pop(name, None)
+                        results[name] = ('blocked', 0.0)
+                    else:
+                        running[executor.submit(self.runStage, name)] = name
+                if len(running) == 0: continue # only blocked stages this round, their dependents are checked next
+                done, pending = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        try:
+            with open(self.path, 'w') as f:
+                json.dump(self.state, f)
+        except Exception as e:
+            print('Pipeline.run(): ' + str(e))
+        for name in self.stages:
+            print("{:<24} {:<8} {:>8.2f}s".format(name, results[name][0], results[name][1]))
+        print("{:<24} {:<8} {:>8.2f}s".format("total", "", time.time() - start))
+        return results
+
+class Throttle(): # AIMD congestion controller of an account, shared by the scraping workers using it
+    def __init__(self, maximum : int, start : int = 10, minimum : int = 1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(min(start, maximum)) # number of requests allowed in flight
+        self.threshold = float(maximum) # slow start threshold
+        self.inflight = 0
+        self.peak = 0 # highest number of requests in flight
+        self.latency = None # smoothed latency of the successful requests
+        self.best = None # lowest smoothed latency seen, used as the baseline (the lowest single sample is a lucky outlier)
+        self.errors = 0.0 # smoothed error rate
+        self.last_cut = 0
+        self.cond = Condition()
+        self.waker = None # asyncio.Event for the async engine
+
+    def acquire(self): # wait for a free slot (thread engine)
+        with self.cond:
+            while self.inflight >= int(self.limit):
+                self.cond.wait()
+            self.inflight += 1
+            self.peak = max(self.peak, self.inflight)
+
+    async def acquireAsync(self): # wait for a free slot (async engine)
+        while True:
+            with self.cond:
+                if self.inflight < int(self.limit):
+                    self.inflight += 1
+                    self.peak = max(self.peak, self.inflight)
+                    return
+                if self.waker is None:
+                    import asyncio
+                    self.waker = asyncio.Event()
+                waker = self.waker
+            await waker.wait()
+
+    def release(self, ok : bool, latency : float): # free the slot and update the limit with the request outcome
+        with self.cond:
+            self.inflight -= 1
+            self.errors = self.errors * 0.95 + (0 if ok else 0.05)
+            if ok:
+                self.latency = latency if self.latency is None else self.latency * 0.9 + latency * 0.1
+                if self.best is None or self.latency < self.best: self.best = self.latency
+                if self.latency > self.best * 4 and self.latency - self.best > 0.2: self.decrease() # latency is rising, the server is struggling
+                elif self.limit < self.threshold: self.limit = min(self.maximum, self.limit + 1) # slow start
+                else: self.limit = min(self.maximum, self.limit + 1 / self.limit) # additive increase
+            elif self.errors > 0.1: # a few random errors are expected, only a rising error rate means we are throttled
+                self.decrease()
+            self.cond.notify_all()
+            if self.waker is not None:
+                self.waker.set()
+                self.waker = None
+
+    def decrease(self): # multiplicative decrease, at most once per latency window so a burst of errors counts once
+        now = time.time()
+        if now - self.last_cut < (self.latency or 1): return
+        self.last_cut = now
+        self.limit = max(self.minimum, self.limit / 2)
+        self.threshold = self.limit
+
+    def backoff(self, attempt : int): # jittered exponential delay before retrying a page
+        return random.uniform(0, min(30, 0.25 * 2 ** attempt))
+
+class Journal(): # append-only file of the ranking pages retrieved so far, one json line per page after a header line (start time and ranking size), used to resume a scrape
+    def __init__(self, path : str):
+        self.path = path
+        self.pages = {} # page -> offset of its line in the file
+        self.lock = Lock()
+        self.file = None
+        self.start = None # time the scrape of this journal started
+
+    def load(self, count : int = None, max_age : float = None): # index the pages of a previous run and open the file for appending. a journal started more than max_age seconds ago, or for a ranking of another size, is discarded. return the number of pages already retrieved
+        end = 0
+        header = None
+        try:
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    try: entry = json.loads(line)
+                    except: break # truncated line, the previous run died while writing it
+                    if 'page' in entry: self.pages[entry['page']] = end
+                    elif end == 0: header = entry
+                    else: break
+                    end += len(line)
+        except FileNotFoundError:
+            pass
+        if end > 0: # check the previous run isn't too old to be mixed with this one
+            reason = None
+            if header is None: reason = "no header"
+            elif max_age is not None and time.time() - header['start'] > max_age: reason = "started {} minutes ago".format(int(time.time() - header['start']) // 60)
+            elif count is not None and header.get('count') is not None and header['count'] != count: reason = "the ranking had {} entries, it has {} now".format(header['count'], count)
+            if reason is not None:
+                print("Discarding '{}' ({})".format(self.path, reason))
+                self.pages = {}
+                header = None
+                end = 0
+        self.file = open(self.path, 'ab')
+        self.file.truncate(end)
+        if header is None:
+            header = {'start':time.time(), 'count':count}
+            self.file.write((json.dumps(header) + '\n').encode('utf-8'))
+            self.file.flush()
+        self.start = header['start']
+        return len(self.pages)
+
+    def rows(self): # iterate over the journaled pages in page order, return (page, rows)
+        with self.lock:
+            if self.file is not None: self.file.flush()
+            index = sorted(self.pages.items())
+        with open(self.path, 'rb') as f:
+            for page, offset in index:
+                f.seek(offset)
+                yield page, json.loads(f.readline())['list']
+
+    def export(self, name : str, count : int, key : str, compress : bool = False): # write the journaled rows in a ndjson file, one line per rank ({} for the holes)
+        pending = {} # rows waiting to be written, only a few pages at most are kept in memory
+        nxt = 1 # next rank to write
+        slack = 0
+        with (gzip.open(name, 'wt', encoding='utf-8') if compress else open(name, 'w', encoding='utf-8')) as out:
+            def flush(upto): # write the ranks until upto (excluded)
+                nonlocal nxt
+                while nxt < upto:
+                    out.write(json.dumps(pending.pop(nxt, {})) + '\n')
+                    nxt += 1
+            for page, rows in self.rows():
+                slack = max(slack, len(rows)) # rows can move to a neighbour page while we scrape
+                low = None
+                for r in rows:
+                    rank = int(r[key])
+                    if nxt <= rank <= count:
+                        pending[rank] = r
+                        if low is None or rank < low: low = rank
+                if low is not None: flush(low - slack)
+            flush(count + 1)
+
+    def append(self, page : int, rows : list): # write a page and flush it right away
+        line = (json.dumps({'page':page, 'list':rows}) + '\n').encode('utf-8')
+        with self.lock:
+            self.pages[page] = self.file.tell()
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self, delete : bool = False): # close the file, delete it once the final file has been written
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            if delete:
+                try: os.remove(self.path)
+                except: pass
+
+def writeSnapshot(path : str, rows, crew : bool = None): # write the rows of a ranking (in rank order, {} for the holes) in the .snap format, crew is guessed from the rows if None. return the number of rows
+    # layout, little-endian: header, then the columns of the n rows (row i = rank i+1, id 0 for a hole):
+    # id (int64), point (int64), sorted ids of the index (int64), level (int32, -1 if none), defeat (int32, -1 if none), name offsets in the string table (n+1 uint32), rows of the index (uint32), string table (utf-8)
+    # only the fields used by gwscrap are kept
+    ids, points, levels, defeats, names = array('q'), array('q'), array('i'), array('i'), array('I', [0])
+    strings = bytearray()
+    for r in rows:
+        if crew is None and len(r) > 0: crew = 'user_id' not in r
+        if len(r) == 0:
+            ids.append(0)
+            points.append(0)
+            levels.append(-1)
+            defeats.append(-1)
+        else:
+            ids.append(int(r['id' if crew else 'user_id']))
+            points.append(int(r['point']))
+            levels.append(int(r.get('level', -1)))
+            defeats.append(int(r.get('defeat', -1)))
+            strings += r['name'].encode('utf-8')
+        names.append(len(strings))
+    order = sorted((i for i in range(len(ids)) if ids[i] != 0), key=ids.__getitem__)
+    index_ids, index_rows = array('q', (ids[i] for i in order)), array('I', order)
+    with open(path + '.tmp', 'wb') as f: # the file is swapped at the end, a reader never sees a partial snapshot
+        f.write(Snapshot.HEADER.pack(Snapshot.MAGIC, 0 if crew in (None, True) else 1, len(ids), len(index_ids)))
+        for column in [ids, points, index_ids, levels, defeats, names, index_rows]:
+            if sys.byteorder == 'big': column.byteswap()
+            f.write(column.tobytes())
+        f.write(strings)
+    os.replace(path + '.tmp', path)
+    return len(ids)
+
+def convertRanking(path : str): # convert a ranking file to .snap, or a .snap file back to .json. return the new file name
+    if path.endswith('.snap'):
+        name = path[:-len('.snap')] + '.json'
+        rows = list(readRanking(path))
+        with open(name, 'w') as f:
+            json.dump(rows, f)
+    else:
+        name = path
+        for ext in ['.json', '.ndjson', '.ndjson.gz']:
+            if path.endswith(ext): name = path[:-len(ext)]
+        name += '.snap'
+        writeSnapshot(name, readRanking(path))
+    return name
+
+class Snapshot(): # a .snap ranking file (see writeSnapshot), memory mapped: the rows are read by rank or by id (binary search) without loading the file
+    HEADER = struct.Struct('<8sB3xII12x') # magic, kind (0 = crew, 1 = player), number of rows, number of ids in the index
+    MAGIC = b'GWSNAP1\0'
+
+    def __init__(self, path : str):
+        if sys.byteorder == 'big': raise Exception("The .snap files can't be read on a big-endian machine")
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, kind, self.count, indexed = self.HEADER.unpack_from(self.mm, 0)
+        if magic != self.MAGIC:
+            self.close()
+            raise Exception("'{}' isn't a .snap file".format(path))
+        self.crew = kind == 0
+        view = memoryview(self.mm)
+        offset = self.HEADER.size
+        self.columns = []
+        for fmt, size in [('q', self.count), ('q', self.count), ('q', indexed), ('i', self.count), ('i', self.count), ('I', self.count + 1), ('I', indexed)]:
+            end = offset + size * struct.calcsize(fmt)
+            self.columns.append(view[offset:end].cast(fmt))
+            offset = end
+        self.ids, self.points, self.index_ids, self.levels, self.defeats, self.names, self.index_rows = self.columns
+        self.strings = offset
+        view.release()
+
+    def __len__(self):
+        return self.count
+
+    def row(self, i : int): # row i (rank i+1) in the same format as the json files, {} for a hole
+        id = self.ids[i]
+        if id == 0: return {}
+        name = self.mm[self.strings + self.names[i]:self.strings + self.names[i+1]].decode('utf-8')
+        if self.crew: return {'id':str(id), 'name':name, 'point':str(self.points[i]), 'ranking':str(i+1)}
+        r = {'user_id':str(id), 'name':name, 'point':str(self.points[i]), 'rank':str(i+1)}
+        if self.levels[i] != -1: r['level'] = str(self.levels[i])
+        if self.defeats[i] != -1: r['defeat'] = str(self.defeats[i])
+        return r
+
+    def byRank(self, rank : int): # return the row at this rank, None if out of the ranking
+        if rank < 1 or rank > self.count: return None
+        return self.row(rank - 1)
+
+    def byId(self, id): # return the row of this crew or player id, None if not found
+        id = int(id)
+        i = bisect.bisect_left(self.index_ids, id)
+        if i == len(self.index_ids) or self.index_ids[i] != id: return None
+        return self.row(self.index_rows[i])
+
+    def rows(self): # iterate over all the rows in rank order
+        for i in range(self.count):
+            yield self.row(i)
+
+    def close(self):
+        for c in getattr(self, 'columns', []): c.release()
+        self.columns = []
+        self.mm.close()
+        self.file.close()
+
+class Archive(): # append-only history of a ranking: a base snapshot of all the rows, then only the rows which changed at each scrape (keyed by id). every record is zlib compressed, one [id, row] json line per row (row is None for a removed id)
+    HEADER = struct.Struct('<4sqBI') # magic, timestamp, 0 = base / 1 = delta, payload size
+    MAGIC = b'GWAR'
+
+    def __init__(self, path : str, rebase : int = 24):
+        self.path = path
+        self.rebase = rebase # a new base is written after this many deltas, to keep the reconstruction short
+        self.records = [] # (timestamp, kind, payload offset, payload size)
+        self.index_file = path + '.idx' # sqlite table of the ids and row hashes of the last record, to find the changed rows without keeping the ranking in memory (see append)
+        self.load()
+
+    def load(self): # index the records, a truncated one at the end (interrupted write) is cut
+        end = 0
+        try:
+            size = os.path.getsize(self.path)
+            with open(self.path, 'rb') as f:
+                while True:
+                    header = f.read(self.HEADER.size)
+                    if len(header) < self.HEADER.size: break
+                    magic, ts, kind, length = self.HEADER.unpack(header)
+                    if magic != self.MAGIC or end + self.HEADER.size + length > size: break
+                    self.records.append((ts, kind, end + self.HEADER.size, length))
+                    end += self.HEADER.size + length
+                    f.seek(end)
+            if end < size:
+                with open(self.path, 'r+b') as f: f.truncate(end)
+        except FileNotFoundError:
+            pass
+
+    def read(self, i : int): # iterate over the (id, row) of a record, decompressed by chunks
+        ts, kind, offset, length = self.records[i]
+        z = zlib.decompressobj()
+        buffer = b''
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while length > 0:
+                chunk = f.read(min(1048576, length))
+                length -= len(chunk)
+                lines = (buffer + z.decompress(chunk)).split(b'\n')
+                buffer = lines.pop()
+                for line in lines: yield json.loads(line)
+        buffer += z.flush()
+        if len(buffer) > 0: yield json.loads(buffer)
+
+    def index(self, ts : int): # record of the last scrape at or before ts
+        i = bisect.bisect_right([r[0] for r in self.records], ts) - 1
+        if i < 0: raise Exception("No snapshot before {} in '{}'".format(ts, self.path))
+        return i
+
+    def replay(self, i : int): # id -> row after the record i: its base and the deltas up to it
+        base = i
+        while self.records[base][1] != 0: base -= 1
+        state = {}
+        for j in range(base, i + 1):
+            for id, row in self.read(j):
+                if row is None: state.pop(id, None)
+                else: state[id] = row
+        return state
+
+    def digest(self, row : dict): # 64 bits hash of a row
+        return int.from_bytes(hashlib.blake2b(json.dumps(row, sort_keys=True).encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+    def openIndex(self): # open the row hashes of the last record, rebuilt from the archive if they don't match it (deleted, or the archive was written without them)
+        conn = sqlite3.connect(self.index_file)
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('CREATE TABLE IF NOT EXISTS digests (id INTEGER PRIMARY KEY, digest int, record int)')
+        conn.execute('CREATE TABLE IF NOT EXISTS info (records int, size int)')
+        info = conn.execute('SELECT records, size FROM info').fetchone()
+        size = os.path.getsize(self.path) if len(self.records) > 0 else 0
+        if info != (len(self.records), size):
+            with conn:
+                conn.execute('DELETE FROM digests')
+                conn.execute('DELETE FROM info')
+                if len(self.records) > 0:
+                    base = len(self.records) - 1
+                    while self.records[base][1] != 0: base -= 1
+                    for j in range(base, len(self.records)):
+                        for id, row in self.read(j):
+                            if row is None: conn.execute('DELETE FROM digests WHERE id = ?', (int(id),))
+                            else: conn.execute('INSERT OR REPLACE INTO digests VALUES (?,?,?)', (int(id), self.digest(row), len(self.records)))
+                conn.execute('INSERT INTO info VALUES (?,?)', (len(self.records), size))
+        return conn
+
+    def at(self, ts : int): # the ranking at this timestamp, in rank order
+        rows = list(self.replay(self.index(ts)).values())
+        key = 'rank' if len(rows) > 0 and 'user_id' in rows[0] else 'ranking'
+        return sorted(rows, key=lambda r: int(r.get(key, 0)))
+
+    def append(self, rows, ts : int): # add a scraped ranking ({} holes are ignored). the rows are streamed and compared to the hashes of the index file, the memory use doesn't depend on the ranking size. return the record kind and its size in bytes
+        conn = self.openIndex()
+        since = 0 # deltas since the last base
+        while since < len(self.records) and self.records[-1-since][1] != 0: since += 1
+        kind = 1
+        if len(self.records) == 0 or since + 1 >= self.rebase: kind = 0
+        elif since > 0 and sum(r[3] for r in self.records[-since:]) > self.records[-1-since][3] // 2: kind = 0 # the deltas are getting as costly to replay as a new base
+        record = len(self.records) + 1 # marks the ids seen in this scrape
+        z = zlib.compressobj(6)
+        length = 0
+        try:
+            with open(self.path, 'r+b' if os.path.exists(self.path) else 'w+b') as f:
+                start = f.seek(0, 2)
+                try:
+                    f.write(b'\0' * self.HEADER.size) # the header is written once the payload is complete, an interrupted write is cut by load
+                    def write(id, row):
+                        nonlocal length
+                        data = z.compress((json.dumps([str(id), row], separators=(',', ':')) + '\n').encode('utf-8'))
+                        f.write(data)
+                        length += len(data)
+                    def flush(batch): # compare a batch of rows to their previous hashes
+                        known = {} if kind == 0 else dict(conn.execute('SELECT id, digest FROM digests WHERE id IN ({})'.format(','.join('?' * len(batch))), [x[0] for x in batch]).fetchall())
+                        for id, h, r in batch:
+                            if known.get(id) != h: write(id, r)
+                        conn.executemany('INSERT OR REPLACE INTO digests VALUES (?,?,?)', [(id, h, record) for id, h, r in batch])
+                    if kind == 0: conn.execute('DELETE FROM digests')
+                    batch = []
+                    for r in rows:
+                        if len(r) == 0: continue
+                        batch.append((int(r['id'] if 'id' in r else r['user_id']), self.digest(r), r))
+                        if len(batch) == 500:
+                            flush(batch)
+                            batch = []
+                    if len(batch) > 0: flush(batch)
+                    if kind == 1:
+                        for id, in conn.execute('SELECT id FROM digests WHERE record < ?', (record,)): write(id, None) # left the ranking
+                        conn.execute('DELETE FROM digests WHERE record < ?', (record,))
+                    data = z.flush()
+                    f.write(data)
+                    length += len(data)
+                    f.seek(start)
+                    f.write(self.HEADER.pack(self.MAGIC, int(ts), kind, length))
+                    size = f.seek(0, 2)
+                except Exception:
+                    f.truncate(start) # or the next records would be appended after a half written one, and cut with it by load
+                    raise
+            self.records.append((int(ts), kind, start + self.HEADER.size, length))
+            conn.execute('UPDATE info SET records = ?, size = ?', (len(self.records), size))
+            conn.commit()
+        finally:
+            conn.close() # not committed if the write failed, the index is rebuilt the next time
+        return kind, self.HEADER.size + length
+
+    def diff(self, ts_a : int, ts_b : int): # iterate over the (id, row at ts_a, row at ts_b) which differ, None when the id isn't in one of them. only the records between the two are read after the first one
+        a, b = self.index(ts_a), self.index(ts_b)
+        if a > b:
+            for id, o, n in self.diff(ts_b, ts_a): yield id, n, o
+            return
+        old = self.replay(a)
+        new = {} # rows changed after a, None for the removed ones
+        ids = set()
+        for j in range(a + 1, b + 1):
+            if self.records[j][1] == 0: # a base: everything can have changed
+                new = dict(self.read(j))
+                ids = set(old) | set(new)
+            else:
+                for id, row in self.read(j):
+                    new[id] = row
+                    ids.add(id)
+        for id in sorted(ids, key=int):
+            o, n = old.get(id), new.get(id)
+            if o != n: yield id, o, n
+
+class Session(): # a game account: parsed cookie jar, prebuilt request headers and urls, its own http client and throttle
+    def __init__(self, data : dict, host : str, gw : int, metrics : Metrics = None, connections : int = 100):
+        self.id = data['id']
+        self.user_agent = data['user_agent']
+        self.metrics = metrics
+        self.lock = Lock() # only taken to update the cookies, the requests read the current snapshot without locking
+        self.jar = {} # cookie name -> value
+        for c in data['cookie'].split(';'):
+            if '=' not in c: continue
+            k, v = c.strip().split('=', 1)
+            self.jar[k] = v
+        self.version = None
+        # urls, only the page and the timestamps are left to format
+        base_url = host + "/teamraid" + str(gw).zfill(3)
+        uid = "&uid=" + str(self.id)
+        self.crew_url = base_url + "/rest/ranking/totalguild/detail/{}/0?_={}&t={}" + uid
+        self.player_url = base_url + "/rest_ranking_user/detail/{}/0?_={}&t={}" + uid
+        self.guild_info_url = host + "/guild_other/guild_info/{}?_={}&t={}" + uid
+        self.member_list_url = host + "/guild_other/member_list/{}/{}?_={}&t={}" + uid
+        self.home_headers = {'Host': 'game.granbluefantasy.jp', 'User-Agent': self.user_agent, 'Accept-Encoding': 'gzip, deflate', 'Accept-Language': 'en', 'Connection': 'keep-alive'}
+        self.snapshot()
+        import httpx # imported when the network is needed only, it's slow to load
+        limits = httpx.Limits(max_keepalive_connections=connections, max_connections=connections, keepalive_expiry=10)
+        self.client = httpx.Client(http2=True, limits=limits)
+        self.async_client = None # opened by Scraper.scrapeAsync
+        self.throttle = Throttle(connections) # each account has its own rate budget on the server side
+        # health, see SessionPool.report
+        self.failures = 0 # consecutive failed requests
+        self.strikes = 0 # number of times it got pulled out of the rotation in a row
+        self.benched_until = 0
+
+    def snapshot(self): # build new cookie and header snapshots. they are never modified afterward, so a request can use them while they are replaced
+        self.cookie = "; ".join("{}={}".format(k, v) for k, v in self.jar.items())
+        self.headers = {'Cookie': self.cookie, 'Referer': 'https://game.granbluefantasy.jp/', 'Origin': 'https://game.granbluefantasy.jp', 'Host': 'game.granbluefantasy.jp', 'User-Agent': self.user_agent, 'X-Requested-With': 'XMLHttpRequest', 'X-VERSION': str(self.version), 'Accept': 'application/json, text/javascript, */*; q=0.01', 'Accept-Encoding': 'gzip, deflate', 'Accept-Language': 'en', 'Connection': 'keep-alive', 'Content-Type': 'application/json'}
+
+    def setVersion(self, version):
+        with self.lock:
+            self.version = version
+            self.snapshot()
+
+    def update(self, cookies : list): # apply the set-cookie headers of a response. like before, only the cookies we already have are updated
+        changes = []
+        for c in cookies:
+            c = c.split(';', 1)[0].strip() # drop the attributes (path, domain, ...)
+            if '=' not in c: continue
+            k, v = c.split('=', 1)
+            if self.jar.get(k, v) != v: changes.append((k, v))
+        if len(changes) == 0: return
+        start = time.perf_counter()
+        with self.lock:
+            if self.metrics is not None: self.metrics.observe('lock_wait_seconds', time.perf_counter() - start, lock='cookie')
+            for k, v in changes: self.jar[k] = v
+            self.snapshot()
+
+class SessionPool(): # the accounts of config.json. the requests are spread between them and an account failing repeatedly is pulled out of the rotation for a while
+    FAILURES = 10 # consecutive failures before an account is pulled out
+    COOLDOWN = 30 # seconds out of the rotation, doubled every time it happens again (up to 10 minutes)
+
+    def __init__(self, identities : list, host : str, gw : int, metrics : Metrics = None, connections : int = 100):
+        self.sessions = [Session(d, host, gw, metrics, connections) for d in identities]
+        self.metrics = metrics
+        self.lock = Lock()
+        self.turn = 0 # to rotate between the sessions with the same number of free slots
+
+    def pick(self): # return the healthy session with the most free slots. if they are all out, the first one coming back
+        now = time.time()
+        with self.lock:
+            healthy = [s for s in self.sessions if s.benched_until <= now]
+            if len(healthy) == 0: return min(self.sessions, key=lambda s: s.benched_until)
+            self.turn = (self.turn + 1) % len(healthy)
+            healthy = healthy[self.turn:] + healthy[:self.turn]
+            return max(healthy, key=lambda s: int(s.throttle.limit) - s.throttle.inflight)
+
+    def report(self, session : Session, ok : bool): # update the health of a session with a request outcome
+        if ok:
+            session.failures = 0
+            session.strikes = 0
+            return
+        with self.lock:
+            if session.benched_until > time.time(): return # requests sent before it got pulled out
+            session.failures += 1
+            if session.failures < self.FAILURES: return
+            cooldown = min(600, self.COOLDOWN * 2 ** session.strikes)
+            session.benched_until = time.time() + cooldown
+            session.failures = self.FAILURES - 1 # on probation when it comes back: one more failure and it's out again
+            session.strikes += 1
+        if self.metrics is not None: self.metrics.inc('account_benched_total', account=session.id)
+        print("Account {} pulled out of the rotation for {}s".format(session.id, cooldown))
+
+    def healthy(self): # number of sessions in the rotation
+        now = time.time()
+        return sum(1 for s in self.sessions if s.benched_until <= now)
+
+    def limit(self): # total concurrency allowed by the throttles
+        return sum(int(s.throttle.limit) for s in self.sessions)
+
+    def inflight(self):
+        return sum(s.throttle.inflight for s in self.sessions)
+
+    def peak(self):
+        return sum(s.throttle.peak for s in self.sessions)
+
+    def setVersion(self, version):
+        for s in self.sessions: s.setVersion(version)
 
 class Scraper():
-    def __init__(self, gw_num : int): # constructor requires the gw number
+    def __init__(self, gw_num : int, host : str = "https://game.granbluefantasy.jp"): # constructor requires the gw number. host can be changed to use a local server (see mockserver.py)
         if gw_num < 1 or gw_num > 999: raise Exception("Invalid GW ID")
         self.gbfg_ids = ["1744673", "645927", "977866", "745085", "1317803", "940560", "1049216", "841064", "1036007", "705648", "599992", "1807204", "472465", "1161924", "432330", "1629318", "1837508", "1880420", "678459", "632242", "1141898", "1380234", "1601132", "1580990", "844716", "581111", "1010961"]
-        
-        limits = httpx.Limits(max_keepalive_connections=100, max_connections=100, keepalive_expiry=10)
-        self.client = httpx.Client(http2=True, limits=limits)
         self.gw = gw_num
-        self.max_threads = 100 # change this if needed
-        self.lock = Lock()
-        # preparing urls
-        base_url = "https://game.granbluefantasy.jp/teamraid" + str(gw_num).zfill(3)
-        self.crew_url = base_url + "/rest/ranking/totalguild/detail/{}/0?_={}&t={}&uid={}"
-        self.player_url = base_url + "/rest_ranking_user/detail/{}/0?_={}&t={}&uid={}"
+        self.host = host
+        self.max_threads = 100 # per account, change this if needed. it's only the ceiling, the real concurrency is found at runtime by the throttles
+        self.engine = 'thread' # scraping engine used by run(): 'thread' or 'async'
+        self.journals = [] # journals of the scrapes in progress
+        self.journal_max_age = 3600 # seconds after which the journal of an interrupted scrape isn't resumed anymore (None to always resume)
+        self.repair_budget = 60 # seconds allowed to fix the gaps of a scraped ranking (0 to disable, see repairRanking)
+        self.shard_timeout = 300 # seconds without a heartbeat from a remote shard (or without it starting) before its pages are retrieved here, see scrapeSharded
+        self.gap_window = 5 # pages around a rank where findGaps looks for the rows claiming it (the ids seen on distant pages are found separately)
+        self.watch_interval = 300 # seconds between two polls of watch()
+        self.watch_borders = [1000, 2000, 3000, 5000, 10000] # ranks followed by watch() by default
+        self.watch_search = 5 # pages searched on each side of its last position when a followed crew or player moved
+        self.archive = True # append every scraped ranking to GW{n}_crew.archive / GW{n}_player.archive, only the rows which changed are stored (see Archive)
+        self.history_file = 'history.sql' # persistent database where every scraped ranking is appended (None to disable)
+        self.metrics = Metrics()
+        self.metrics_format = 'json' # format of the GW{n}_metrics file written after each operation: 'json' or 'prom' (prometheus text format)
+        self.stage_depth = 0
+        self.stage_lock = Lock()
+        self.output = 'json' # ranking output format: 'json', 'snap' (see writeSnapshot), or 'ndjson'/'ndjson.gz' to stream the pages to the disk instead of keeping them in memory
+        self.gbfg_cache = 'gbfg_cache.json' # member lists of the last /gbfg/ download, to skip the crews which didn't change
+        self.gbfg_ttl = 6 * 3600 # seconds during which a cached member list is used without checking it
+        self.gbfg_private_ttl = 24 * 3600 # same for the private crews
+        self.gbfg_checks = 3 # times in a row a cached crew can be confirmed by its member pages only, everything is downloaded again after that (to see a name change for example)
+        self.gbfg_index = 'gbfg_index.json' # gbfg/ files already merged in gbfg.json (name -> mtime, size, hash) and the merged data
         # empty save data
         self.data = {'id':0, 'cookie':'', 'user_agent':''}
         self.version = None
+        self.version_file = 'version.json' # cache of the game version
+        self.version_ttl = 3600 # seconds before the cached version is checked again
+        self.version_cached = False # True if the current version comes from the cache (see updateVersion)
         self.vregex = re.compile("Game\.version = \"(\d+)\";")
         # load our data
         if not self.load():
             self.save() # failed? we make an empty file
             print("No 'config.json' file found.\nAn empty 'config.json' files has been created\nPlease fill it with your cookie, user agent and GBF profile id")
-            exit(0)
+            sys.exit(1)
+        self._pool = None # see pool
         # for Ctrl+C
         signal.signal(signal.SIGINT, self.exit)
 
-    def exit(self): # called by ctrl+C
+    @property
+    def pool(self): # sessions of the accounts, only created once the network is needed
+        if self._pool is None:
+            self._pool = SessionPool(self.identities(), self.host, self.gw, self.metrics, self.max_threads)
+            if len(self._pool.sessions) > 1: print(len(self._pool.sessions), "accounts loaded")
+        return self._pool
+
+    def exit(self, *args): # called by ctrl+C
         print("Saving...")
         self.save()
+        if len(self.journals) > 0:
+            for j in self.journals: j.close()
+            print("The pages retrieved so far are saved, run the same download again to resume")
+        sys.stdout.flush() # os._exit doesn't flush
+        os._exit(130) # interrupted, not a success for the scripts running the headless mode
+
+    def identities(self): # config.json holds one account, or a list of accounts to spread the requests between
+        return self.data if isinstance(self.data, list) else [self.data]
 
     def load(self): # load cookie and stuff
         try:
             with open('config.json') as f:
-                data = json.load(f)
-                if 'id' not in self.data or 'cookie' not in self.data or 'user_agent' not in self.data: raise Exception("Missing settings in config.json")
-                self.data = data
+                self.data = json.load(f)
+                if len(self.identities()) == 0: raise Exception("No account in config.json")
+                for d in self.identities():
+                    if 'id' not in d or 'cookie' not in d or 'user_agent' not in d: raise Exception("Missing settings in config.json")
                 return True
         except Exception as e:
             print('load(): ' + str(e))
@@ -56,6 +880,8 @@ class Scraper():
 
     def save(self): # save
         try:
+            if getattr(self, '_pool', None) is not None:
+                for d, s in zip(self.identities(), self._pool.sessions): d['cookie'] = s.cookie
             with open('config.json', 'w') as outfile:
                 json.dump(self.data, outfile)
             return True
@@ -72,183 +898,754 @@ class Scraper():
             print('writeFile(): ' + str(e))
             return False
 
+    def writeSnap(self, rows, name, crew = None): # write a ranking in the .snap format
+        try:
+            writeSnapshot(name, rows, crew)
+            return True
+        except Exception as e:
+            print('writeSnap(): ' + str(e))
+            return False
+
     def getGameversion(self): # get the game version
         try:
-            response = self.client.get('https://game.granbluefantasy.jp/', headers={'Host': 'game.granbluefantasy.jp', 'User-Agent': self.data['user_agent'], 'Accept-Encoding': 'gzip, deflate', 'Accept-Language': 'en', 'Connection': 'keep-alive'})
+            session = self.pool.pick()
+            response = session.client.get(self.host + '/', headers=session.home_headers)
             if response.status_code != 200: raise Exception()
             res = self.vregex.findall(response.content.decode('utf-8'))
             return int(res[0]) # to check if digit
         except:
             return None
 
-    def updateCookie(self, new): # update the cookie string
-        A = self.data['cookie'].split(';')
-        B = new.split(';')
-        for c in B:
-            tA = c.split('=')
-            if tA[0][0] == " ": tA[0] = tA[0][1:]
-            for i in range(0, len(A)):
-                tB = A[i].split('=')
-                if tB[0][0] == " ": tB[0] = tB[0][1:]
-                if tA[0] == tB[0]:
-                    A[i] = c
-                    break
-        with self.lock:
-            self.data['cookie'] = ";".join(A)
+    def updateVersion(self, refresh = False): # set the game version, from the cache file if it's recent enough unless refresh is True. return False if it can't be found
+        version = None
+        if not refresh:
+            try:
+                with open(self.version_file) as f:
+                    cache = json.load(f)
+                if time.time() - cache['time'] < self.version_ttl: version = cache['version']
+            except:
+                pass
+        self.version_cached = version is not None
+        if version is None:
+            version = self.getGameversion()
+            if version is None:
+                print("Impossible to get the game version currently")
+                return False
+            try:
+                with open(self.version_file, 'w') as f:
+                    json.dump({'version':str(version), 'time':time.time()}, f)
+            except Exception as e:
+                print('updateVersion(): ' + str(e))
+        self.version = str(version)
+        self.pool.setVersion(self.version)
+        return True
+
+    def firstPage(self, crew = True): # request the first page of a ranking. if it fails with a cached game version, the version is checked again in case it changed
+        data = self.requestRanking(1, crew)
+        if (data is None or data['count'] == False) and self.version_cached:
+            print("Checking the game version again...")
+            if self.updateVersion(True): data = self.requestRanking(1, crew)
+        return data
 
-    def requestRanking(self, page, crew = True): # request a ranking page and return the data
+    def writeMetrics(self): # export the metrics recorded so far
         try:
-            ts = int(datetime.now(timezone.utc).replace(tzinfo=None).timestamp() * 1000)
-            if crew: url = self.crew_url.format(page, ts, ts+300, self.data['id'])
-            else: url = self.player_url.format(page, ts, ts+300, self.data['id'])
-            response = self.client.get(url, headers={'Cookie': self.data['cookie'], 'Referer': 'https://game.granbluefantasy.jp/', 'Origin': 'https://game.granbluefantasy.jp', 'Host': 'game.granbluefantasy.jp', 'User-Agent': self.data['user_agent'], 'X-Requested-With': 'XMLHttpRequest', 'X-VERSION': self.version, 'Accept': 'application/json, text/javascript, */*; q=0.01', 'Accept-Encoding': 'gzip, deflate', 'Accept-Language': 'en', 'Connection': 'keep-alive', 'Content-Type': 'application/json'})
-            if response.status_code != 200: raise Exception()
-            try: self.updateCookie(response.headers['set-cookie'])
-            except: pass
-            return response.json()
+            name = 'GW{}_metrics.{}'.format(self.gw, self.metrics_format)
+            with open(name, 'w') as f:
+                if self.metrics_format == 'prom': f.write(self.metrics.toPrometheus())
+                else: json.dump(self.metrics.toJSON(), f, indent=1)
+        except Exception as e:
+            print('writeMetrics(): ' + str(e))
+
+    def readResponse(self, session, response, endpoint, start): # common handling of a response: metrics, cookie update and json decoding
+        self.metrics.observe('request_seconds', time.perf_counter() - start, endpoint=endpoint)
+        self.metrics.inc('responses_total', endpoint=endpoint, status=response.status_code)
+        if response.status_code != 200: raise Exception()
+        self.metrics.inc('response_bytes_total', len(response.content), endpoint=endpoint)
+        session.update(response.headers.get_list('set-cookie'))
+        start = time.perf_counter()
+        data = response.json()
+        self.metrics.observe('decode_seconds', time.perf_counter() - start, endpoint=endpoint)
+        return data
+
+    def rankingRequest(self, session, page, crew = True): # return the url and headers of a ranking page request
+        ts = int(datetime.now(timezone.utc).replace(tzinfo=None).timestamp() * 1000)
+        if crew: url = session.crew_url.format(page, ts, ts+300)
+        else: url = session.player_url.format(page, ts, ts+300)
+        return url, session.headers
+
+    def requestRanking(self, page, crew = True, session = None): # request a ranking page and return the data. session is picked from the pool if not specified
+        try:
+            if session is None: session = self.pool.pick()
+            url, headers = self.rankingRequest(session, page, crew)
+            start = time.perf_counter()
+            response = session.client.get(url, headers=headers)
+            return self.readResponse(session, response, 'crew' if crew else 'player', start)
         except:
+            self.metrics.inc('request_errors_total', endpoint='crew' if crew else 'player')
             return None
 
-    def crewProcess(self, q, results): # thread for crew ranking
+    def requestPage(self, page, crew = True): # request a ranking page until it succeeds, under the throttle control of the account used
+        attempt = 0
+        while True:
+            session = self.pool.pick()
+            session.throttle.acquire()
+            start = time.time()
+            data = self.requestRanking(page, crew, session)
+            ok = data is not None and data['count'] != False
+            session.throttle.release(ok, time.time() - start)
+            self.pool.report(session, ok)
+            if ok: return data
+            print("{}: Error on page".format("Crew" if crew else "Player"), page)
+            self.metrics.inc('retries_total', endpoint='crew' if crew else 'player')
+            time.sleep(session.throttle.backoff(attempt))
+            attempt += 1
+
+    def storePage(self, journal, results, page, rows, crew = True): # journal a retrieved page and put its rows in the results (if not streaming)
+        if journal is not None: journal.append(page, rows)
+        self.metrics.inc('pages_total', endpoint='crew' if crew else 'player')
+        if results is None: return
+        key = 'ranking' if crew else 'rank'
+        for r in rows:
+            rank = int(r[key])
+            if 0 < rank <= len(results): results[rank-1] = r
+
+    def crewProcess(self, q, results, journal): # thread for crew ranking
         while not q.empty():
             page = q.get()
-            data = None
-            while data is None or data['count'] == False:
-                data = self.requestRanking(page, True)
-                if data is None or data['count'] == False: print("Crew: Error on page", page)
-            for i in range(0, len(data['list'])):
-                results[int(data['list'][i]['ranking'])-1] = data['list'][i]
+            data = self.requestPage(page, True)
+            self.storePage(journal, results, page, data['list'], True)
             q.task_done()
         return True
 
-    def playerProcess(self, q, results): # thread for player ranking (same thing, I copypasted)
+    def playerProcess(self, q, results, journal): # thread for player ranking (same thing, I copypasted)
         while not q.empty():
             page = q.get()
-            data = None
-            while data is None or data['count'] == False:
-                data = self.requestRanking(page, False)
-                if data is None or data['count'] == False: print("Player: Error on page", page)
-            for i in range(0, len(data['list'])):
-                results[int(data['list'][i]['rank'])-1] = data['list'][i]
+            data = self.requestPage(page, False)
+            self.storePage(journal, results, page, data['list'], False)
             q.task_done()
         return True
 
-    def run(self, mode = 0): # main loop. 0 = both crews and players, 1 = crews, 2 = players
+    async def requestRankingAsync(self, session, page, crew = True): # same as requestRanking but for the async engine
+        try:
+            url, headers = self.rankingRequest(session, page, crew)
+            start = time.perf_counter()
+            response = await session.async_client.get(url, headers=headers)
+            return self.readResponse(session, response, 'crew' if crew else 'player', start)
+        except:
+            self.metrics.inc('request_errors_total', endpoint='crew' if crew else 'player')
+            return None
+
+    async def requestPageAsync(self, page, crew = True): # same as requestPage but for the async engine
+        import asyncio
+        attempt = 0
+        while True:
+            session = self.pool.pick()
+            await session.throttle.acquireAsync()
+            start = time.time()
+            data = await self.requestRankingAsync(session, page, crew)
+            ok = data is not None and data['count'] != False
+            session.throttle.release(ok, time.time() - start)
+            self.pool.report(session, ok)
+            if ok: return data
+            print("{}: Error on page".format("Crew" if crew else "Player"), page)
+            self.metrics.inc('retries_total', endpoint='crew' if crew else 'player')
+            await asyncio.sleep(session.throttle.backoff(attempt))
+            attempt += 1
+
+    async def pageProcessAsync(self, pages, results, journal, crew = True): # coroutine pulling ranking pages (crew or player) until there is none left
+        for page in pages:
+            data = await self.requestPageAsync(page, crew)
+            self.storePage(journal, results, page, data['list'], crew)
+
+    async def scrapeAsync(self, pages, results, journal, crew = True): # async engine: max_threads coroutines per account sharing the page iterator, the throttles cap the number of requests in flight
+        import asyncio, httpx
+        limits = httpx.Limits(max_keepalive_connections=self.max_threads, max_connections=self.max_threads, keepalive_expiry=10)
+        pages = iter(pages)
+        for s in self.pool.sessions:
+            s.throttle.waker = None
+            s.async_client = httpx.AsyncClient(http2=True, limits=limits)
+        try:
+            await asyncio.gather(*[self.pageProcessAsync(pages, results, journal, crew) for i in range(self.max_threads * len(self.pool.sessions))])
+        finally:
+            for s in self.pool.sessions:
+                await s.async_client.aclose()
+                s.async_client = None
+
+    def progress(self, stop, total, crew = True): # print the progress of a scrape every few seconds, until stop is set
+        endpoint = 'crew' if crew else 'player'
+        base = self.metrics.value('pages_total', endpoint=endpoint)
+        retries = self.metrics.value('retries_total', endpoint=endpoint)
+        start = time.time()
+        while not stop.wait(5):
+            done = self.metrics.value('pages_total', endpoint=endpoint) - base
+            print("Progress: {}/{} pages, {:.1f} pages/s, {} in flight (limit {}), {} retries, p50 latency {:.0f} ms, {}/{} account(s) in use".format(done, total, done / (time.time() - start), self.pool.inflight(), self.pool.limit(), self.metrics.value('retries_total', endpoint=endpoint) - retries, self.metrics.quantile('request_seconds', 0.5, endpoint=endpoint) * 1000, self.pool.healthy(), len(self.pool.sessions)))
+
+    def scrape(self, pages, results, journal, crew = True): # retrieve the given pages with the selected engine
+        print("Scraping with the {} engine...".format(self.engine))
+        start = time.time()
+        stop = Event()
+        Thread(target=self.progress, args=(stop, len(pages), crew), daemon=True).start()
+        if self.engine == 'async':
+            import asyncio
+            asyncio.run(self.scrapeAsync(pages, results, journal, crew))
+        else:
+            q = Queue()
+            for i in pages: # queue the pages to retrieve
+                q.put(i)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_threads * len(self.pool.sessions)) as executor:
+                futures = [executor.submit(self.crewProcess if crew else self.playerProcess, q, results, journal) for i in range(self.max_threads * len(self.pool.sessions))]
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+        stop.set()
+        elapsed = max(time.time() - start, 0.001)
+        endpoint = 'crew' if crew else 'player'
+        self.metrics.gauge('concurrency_limit', self.pool.limit())
+        self.metrics.gauge('inflight_peak', self.pool.peak())
+        self.metrics.gauge('accounts_healthy', self.pool.healthy())
+        print("{} pages scraped in {:.2f}s ({:.1f} pages/s, concurrency settled at {})".format(len(pages), elapsed, len(pages)/elapsed, self.pool.limit()))
+        print("Latency p50 {:.0f} ms / p99 {:.0f} ms, json decoding p50 {:.1f} ms, cookie lock wait p99 {:.2f} ms, {:.1f} MB received, peak of {} requests in flight".format(self.metrics.quantile('request_seconds', 0.5, endpoint=endpoint) * 1000, self.metrics.quantile('request_seconds', 0.99, endpoint=endpoint) * 1000, self.metrics.quantile('decode_seconds', 0.5, endpoint=endpoint) * 1000, self.metrics.quantile('lock_wait_seconds', 0.99, lock='cookie') * 1000, self.metrics.value('response_bytes_total', endpoint=endpoint) / 1048576, self.pool.peak()))
+
+    def scrapeSharded(self, pages, results, journal, crew, shards, remote = False): # split the pages between several workers, each one with its own journal, then merge the journals
+        # each shard is described by a GW{n}_{crew|player}.shard{k}.json file and processed by runShard(), in a local process or with 'python gwscrap.py shard <file>' on any host sharing this folder
+        kind = 'crew' if crew else 'player'
+        specs = []
+        for k in range(shards):
+            name = 'GW{}_{}.shard{}'.format(self.gw, kind, k)
+            for f in [name + '.json.done', name + '.json.alive']: # left by a worker which finished after being given up
+                try: os.remove(f)
+                except: pass
+            with open(name + '.json', 'w') as f:
+                json.dump({'gw':self.gw, 'host':self.host, 'crew':crew, 'version':self.version, 'engine':self.engine, 'pages':pages[k::shards], 'journal':name + '.journal'}, f)
+            specs.append(name + '.json')
+        start = time.time()
+        if remote:
+            print("{} shard files written, run 'python gwscrap.py shard <file>' for each of them, on this machine or on another one sharing this folder and config.json:".format(shards))
+            for path in specs: print(path)
+            print("Waiting for the shards...")
+            beats = {path:(None, start) for path in specs} # last heartbeat file time seen and when it changed, in our clock (the workers can be on other hosts)
+            while len(beats) > 0:
+                time.sleep(1)
+                now = time.time()
+                for path in list(beats):
+                    if isfile(path + '.done'):
+                        del beats[path]
+                        continue
+                    try: beat = os.path.getmtime(path + '.alive')
+                    except FileNotFoundError: beat = None
+                    if beat != beats[path][0]: beats[path] = (beat, now)
+                    elif now - beats[path][1] > self.shard_timeout:
+                        print("'{}': no heartbeat for {} seconds, given up".format(path, self.shard_timeout))
+                        del beats[path]
+        else:
+            print("Scraping with {} processes...".format(shards))
+            with concurrent.futures.ProcessPoolExecutor(max_workers=shards, mp_context=multiprocessing.get_context('spawn')) as executor:
+                futures = {executor.submit(runShard, path):path for path in specs}
+                for future in concurrent.futures.as_completed(futures):
+                    try: print("'{}': {} pages".format(futures[future], future.result()))
+                    except Exception as e: print("'{}' failed: {}".format(futures[future], e)) # its journal is still merged below
+        elapsed = max(time.time() - start, 0.001)
+        print("{} pages scraped by {} shards in {:.2f}s ({:.1f} pages/s)".format(len(pages), shards, elapsed, len(pages)/elapsed))
+        # merge step, with whatever the failed or given up shards retrieved
+        for path in specs:
+            try:
+                with open(path) as f:
+                    spec = json.load(f)
+                shard = Journal(spec['journal'])
+                if shard.load() > 0:
+                    for page, rows in shard.rows():
+                        if page not in journal.pages: self.storePage(journal, results, page, rows, crew)
+                shard.close(True)
+            except Exception as e:
+                print('scrapeSharded(): ' + str(e))
+            for f in [path, path + '.done', path + '.alive']:
+                try: os.remove(f)
+                except: pass
+        missing = [p for p in pages if p not in journal.pages]
+        if len(missing) > 0: # a worker died, failed or was stopped
+            print("{} page(s) missing after the merge".format(len(missing)))
+            self.scrape(missing, results, journal, crew)
+
+    def findGaps(self, journal, count, crew = True): # check the journaled ranking for empty rank slots, ranks claimed by several rows and ids at several ranks. return (pages to fetch again, number of each problem)
+        # the journal is read in page order and only the rows of the last gap_window pages are kept, like in Journal.export: the rows only move between close pages while we scrape
+        # the (id, page) of every row are also kept packed in an array, for the ids found on pages further apart than that (a fast climber)
+        key = 'ranking' if crew else 'rank'
+        idkey = 'id' if crew else 'user_id'
+        claims = {} # rank -> {id: page}, for the ranks not checked yet
+        recent = {} # id -> [first rank, last page, already counted as moved], for the ids of the last pages
+        window = [] # (page, ids) of the last pages
+        located = array('q') # id << 20 | page of every row
+        counted = set() # ids already counted as moved
+        size = 1 # rows per page
+        pages = set()
+        holes = duplicates = moved = 0
+        nxt = 1 # next rank to check
+        def check(upto): # check the ranks until upto (excluded), the next pages can't claim them anymore
+            nonlocal nxt, holes, duplicates
+            while nxt < upto:
+                c = claims.pop(nxt, None)
+                if c is None:
+                    holes += 1
+                    pages.add((nxt - 1) // size + 1)
+                elif len(c) > 1: # the row moved while we were scraping, the page of this rank has the right one
+                    duplicates += 1
+                    pages.add((nxt - 1) // size + 1)
+                    pages.update(c.values())
+                nxt += 1
+        for page, rows in journal.rows():
+            size = max(size, len(rows))
+            ids = []
+            for r in rows:
+                rank = int(r[key])
+                id = r[idkey]
+                if nxt <= rank <= count: claims.setdefault(rank, {})[id] = page
+                seen = recent.get(id)
+                if seen is None:
+                    recent[id] = [rank, page, False]
+                else:
+                    if seen[0] != rank:
+                        if not seen[2]:
+                            moved += 1
+                            seen[2] = True
+                            counted.add(id)
+                        pages.add(seen[1])
+                        pages.add(page)
+                    seen[1] = page
+                ids.append(id)
+                located.append(int(id) << 20 | page)
+            window.append((page, ids))
+            while window[0][0] <= page - self.gap_window: # forget the ids not seen since
+                old, ids = window.pop(0)
+                for id in ids:
+                    if recent.get(id, [0, None])[1] == old: del recent[id]
+            check((page - self.gap_window) * size + 1)
+        check(count + 1)
+        located = array('q', sorted(located)) # the rows of an id are now next to each other
+        for i in range(1, len(located)):
+            a, b = located[i-1], located[i]
+            if a >> 20 != b >> 20 or a == b: continue
+            pages.add(a & 0xFFFFF)
+            pages.add(b & 0xFFFFF)
+            id = str(b >> 20)
+            if id not in counted:
+                moved += 1
+                counted.add(id)
+        return sorted(pages), holes, duplicates, moved
+
+    def repairRanking(self, results, journal, count, crew = True): # fetch again the pages covering the gaps of a scraped ranking, until it's consistent or repair_budget runs out. return True if it's consistent
+        deadline = time.time() + self.repair_budget
+        endpoint = 'crew' if crew else 'player'
+        previous = None # number of problems before the last pass
+        repaired = False
+        while True:
+            pages, holes, duplicates, moved = self.findGaps(journal, count, crew)
+            if len(pages) == 0:
+                print("Ranking verified, no gap")
+                break
+            print("Verification: {} empty rank(s), {} rank(s) claimed twice, {} id(s) at several ranks".format(holes, duplicates, moved))
+            if previous is not None and holes + duplicates + moved >= previous: # the last pass didn't help: the gaps are in the ranking itself, or it moves faster than we can fix it
+                print("The gaps aren't shrinking, giving up")
+                break
+            if time.time() >= deadline:
+                print("Time budget exhausted, {} page(s) still to fix".format(len(pages)))
+                break
+            print("Repairing {} page(s)...".format(len(pages)))
+            self.metrics.inc('repair_pages_total', len(pages), endpoint=endpoint)
+            self.scrape(pages, results, journal, crew)
+            previous = holes + duplicates + moved
+            repaired = True
+        if repaired and results is not None: # the slots holding stale rows are rebuilt from the fixed journal
+            key = 'ranking' if crew else 'rank'
+            for i in range(len(results)): results[i] = {}
+            for page, rows in journal.rows():
+                for r in rows:
+                    rank = int(r[key])
+                    if 0 < rank <= len(results): results[rank-1] = r
+        return len(pages) == 0
+
+    def openJournal(self, name, results, crew = True, count = None): # open the journal of a ranking download and put back the pages of a previous unfinished run in the results (if it isn't older than journal_max_age and the ranking size didn't change)
+        journal = Journal(name)
+        if journal.load(count, self.journal_max_age) > 0:
+            print("Resuming: {} page(s) already retrieved in '{}'".format(len(journal.pages), name))
+            if results is not None:
+                for page, rows in journal.rows():
+                    self.storePage(None, results, page, rows, crew)
+        self.journals.append(journal)
+        return journal
+
+    def closeJournal(self, journal, delete = False):
+        journal.close(delete)
+        self.journals.remove(journal)
+
+    def writeRanking(self, results, journal, count, crew = True): # write a scraped ranking in the selected output format and close its journal. return the file name or None if it failed
+        name = 'GW{}_{}.{}'.format(self.gw, 'crew' if crew else 'player', self.output)
+        if self.output == 'snap':
+            ok = self.writeSnap(results, name, crew)
+        elif results is not None:
+            ok = self.writeFile(results, name)
+        else:
+            print("Reindexing...")
+            try:
+                journal.export(name, count, 'ranking' if crew else 'rank', self.output.endswith('.gz'))
+                ok = True
+            except Exception as e:
+                print('writeRanking(): ' + str(e))
+                ok = False
+        self.closeJournal(journal, ok) # the journal isn't needed anymore once the file is written
+        return name if ok else None
+
+    @stage
+    def run(self, mode = 0, confirm = True, shards = 0, remote = False): # main loop. 0 = both crews and players, 1 = crews, 2 = players. shards > 0 to split the pages between several processes (see scrapeSharded)
         # user check
-        input("Make sure you won't overwrite a file (Press anything to continue): ")
+        if confirm: input("Make sure you won't overwrite a file (Press anything to continue): ")
         # check the game version
-        self.version = str(self.getGameversion())
-        if self.version is None:
-            print("Impossible to get the game version currently")
-            return
+        if not self.updateVersion(): return False
         print("Current game version is", self.version)
+        ts = int(time.time()) # snapshot timestamp for the history database
+        ok = True # False if a ranking couldn't be saved
 
         if mode == 0 or mode == 1:
             # crew ranking
-            data = self.requestRanking(1, True) # get the first page
+            data = self.firstPage(True) # get the first page
             if data is None or data['count'] == False:
                 print("Can't access the crew ranking")
                 self.save()
-                return
+                return False
             count = int(data['count']) # number of crews
             last = data['last'] # number of pages
             print("Crew ranking has {} crews and {} pages".format(count, last))
-            results = [{} for x in range(count)] # make a big array
-            for i in range(0, len(data['list'])): # fill the first slots with the first page data
-                results[i] = data['list'][i]
+            results = [{} for x in range(count)] if self.output in ['json', 'snap'] else None # make a big array (the rows go straight to the disk when streaming)
+            journal = self.openJournal('GW{}_crew.journal'.format(self.gw), results, True, count) # pages from a previous interrupted run
+            stamp = min(ts, int(journal.start)) # a resumed scrape is dated from its start
+            self.storePage(journal, results, 1, data['list'], True) # fill the first slots with the first page data
 
-            q = Queue()
-            for i in range(2, last+1): # queue the pages to retrieve
-                q.put(i)
-
-            print("Scraping...")
-            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_threads) as executor:
-                futures = [executor.submit(self.crewProcess, q, results) for i in range(self.max_threads)]
-                for future in concurrent.futures.as_completed(futures):
-                    future.result()
+            pages = [p for p in range(2, last+1) if p not in journal.pages]
+            if shards > 0: self.scrapeSharded(pages, results, journal, True, shards, remote)
+            else: self.scrape(pages, results, journal, True)
+            if self.repair_budget > 0: self.repairRanking(results, journal, count, True)
 
-            self.writeFile(results, 'GW{}_crew.json'.format(self.gw)) # save the result
-            print("Done, saved to 'GW{}_crew.json'".format(self.gw))
+            name = self.writeRanking(results, journal, count, True) # save the result
+            if name is None: ok = False
+            else:
+                print("Done, saved to '{}'".format(name))
+                self.recordSnapshot(results if results is not None else readRanking(name), stamp, True)
+                if self.archive: self.archiveSnapshot(results if results is not None else readRanking(name), stamp, True)
 
         if mode == 0 or mode == 2:
             # player ranking. exact same thing, I lazily copypasted.
-            data = self.requestRanking(1, False)
+            data = self.firstPage(False)
             if data is None or data['count'] == False:
                 print("Can't access the player ranking")
                 self.save()
-                return
+                return False
             count = int(data['count'])
             last = data['last']
             print("Crew ranking has {} players and {} pages".format(count, last))
-            results = [{} for x in range(count)]
-            for i in range(0, len(data['list'])):
-                results[i] = data['list'][i]
+            results = [{} for x in range(count)] if self.output in ['json', 'snap'] else None
+            journal = self.openJournal('GW{}_player.journal'.format(self.gw), results, False, count)
+            stamp = min(ts, int(journal.start)) # a resumed scrape is dated from its start
+            self.storePage(journal, results, 1, data['list'], False)
 
-            q = Queue()
-            for i in range(2, last+1):
-                q.put(i)
+            pages = [p for p in range(2, last+1) if p not in journal.pages]
+            if shards > 0: self.scrapeSharded(pages, results, journal, False, shards, remote)
+            else: self.scrape(pages, results, journal, False)
+            if self.repair_budget > 0: self.repairRanking(results, journal, count, False)
 
-            print("Scraping...")
-            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_threads) as executor:
-                futures = [executor.submit(self.playerProcess, q, results) for i in range(self.max_threads)]
-                for future in concurrent.futures.as_completed(futures):
-                    future.result()
-            q.join()
-
-            self.writeFile(results, 'GW{}_player.json'.format(self.gw))
-            print("Done, saved to 'GW{}_player.json'".format(self.gw))
+            name = self.writeRanking(results, journal, count, False)
+            if name is None: ok = False
+            else:
+                print("Done, saved to '{}'".format(name))
+                self.recordSnapshot(results if results is not None else readRanking(name), stamp, False)
+                if self.archive: self.archiveSnapshot(results if results is not None else readRanking(name), stamp, False)
             self.save()
+        return ok
 
-    def buildGW(self, mode = 0): # build a .json compiling all the data withing json named with the 'days' suffix
+    def archiveSnapshot(self, rows, ts, crew = True): # append a scraped ranking to its archive
+        try:
+            archive = Archive('GW{}_{}.archive'.format(self.gw, 'crew' if crew else 'player'))
+            kind, size = archive.append(rows, ts)
+            print("{} added to '{}' ({} KB)".format('Full snapshot' if kind == 0 else 'Changes', archive.path, size // 1024))
+        except Exception as e:
+            print('archiveSnapshot(): ' + str(e))
+
+    def openHistory(self): # open the history database, create the tables if needed
+        conn = sqlite3.connect(self.history_file)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS events (gw int PRIMARY KEY, first_seen int, last_seen int);
+            CREATE TABLE IF NOT EXISTS entities (kind int, id int, name text, PRIMARY KEY (kind, id));
+            CREATE TABLE IF NOT EXISTS snapshots (snapshot integer PRIMARY KEY, gw int, kind int, ts int, count int);
+            CREATE TABLE IF NOT EXISTS entries (snapshot int, id int, rank int, point int);
+            CREATE INDEX IF NOT EXISTS snapshots_kind ON snapshots (kind, gw, ts);
+            CREATE INDEX IF NOT EXISTS entries_id ON entries (id, snapshot);
+            CREATE INDEX IF NOT EXISTS entries_rank ON entries (snapshot, rank);
+            CREATE TABLE IF NOT EXISTS watch (gw int, kind int, ts int, id int, rank int, point int);
+            CREATE INDEX IF NOT EXISTS watch_id ON watch (kind, id, ts);
+            CREATE INDEX IF NOT EXISTS watch_rank ON watch (kind, rank, ts);
+        ''') # kind: 0 = crew, 1 = player. watch has the rows polled by watch()
+        return conn
+
+    def recordSnapshot(self, rows, ts, crew = True): # append a scraped ranking to the history database. rows can be any iterable, it's inserted by chunks
+        if self.history_file is None: return
+        try:
+            kind = 0 if crew else 1
+            key, idkey = ('ranking', 'id') if crew else ('rank', 'user_id')
+            conn = self.openHistory()
+            with conn:
+                c = conn.cursor()
+                c.execute('INSERT INTO events VALUES (?,?,?) ON CONFLICT(gw) DO UPDATE SET last_seen = excluded.last_seen', (self.gw, ts, ts))
+                c.execute('INSERT INTO snapshots (gw, kind, ts, count) VALUES (?,?,?,0)', (self.gw, kind, ts))
+                snapshot = c.lastrowid
+                count = 0
+                chunk = []
+                for r in rows:
+                    if idkey in r: chunk.append(r)
+                    if len(chunk) >= 10000:
+                        count += self.recordChunk(c, snapshot, kind, chunk, key, idkey)
+                        chunk = []
+                count += self.recordChunk(c, snapshot, kind, chunk, key, idkey)
+                c.execute('UPDATE snapshots SET count = ? WHERE snapshot = ?', (count, snapshot))
+            conn.close()
+            print("{} rows added to '{}'".format(count, self.history_file))
+        except Exception as e:
+            print('recordSnapshot(): ' + str(e))
+
+    def recordChunk(self, c, snapshot, kind, chunk, key, idkey): # subroutine
+        c.executemany('INSERT INTO entities VALUES (?,?,?) ON CONFLICT(kind, id) DO UPDATE SET name = excluded.name', ((kind, r[idkey], r['name']) for r in chunk))
+        c.executemany('INSERT INTO entries VALUES (?,?,?,?)', ((snapshot, r[idkey], r[key], r['point']) for r in chunk))
+        return len(chunk)
+
+    def history(self, id, crew = True): # return the (gw, timestamp, rank, points) of a crew or player in every snapshot and watch() poll, across all the GWs
+        conn = self.openHistory()
+        res = conn.execute('SELECT s.gw, s.ts, e.rank, e.point FROM entries e JOIN snapshots s ON s.snapshot = e.snapshot WHERE e.id = ? AND s.kind = ? UNION ALL SELECT gw, ts, rank, point FROM watch WHERE id = ? AND kind = ? ORDER BY 2', (id, 0 if crew else 1, id, 0 if crew else 1)).fetchall()
+        conn.close()
+        return res
+
+    def border(self, rank, crew = True, gw = None): # return the (gw, timestamp, id, points) at the given rank in every snapshot and watch() poll (of one GW if specified)
+        conn = self.openHistory()
+        res = conn.execute('SELECT s.gw, s.ts, e.id, e.point FROM snapshots s JOIN entries e ON e.snapshot = s.snapshot AND e.rank = ? WHERE s.kind = ? AND (? IS NULL OR s.gw = ?) UNION ALL SELECT gw, ts, id, point FROM watch WHERE rank = ? AND kind = ? AND (? IS NULL OR gw = ?) ORDER BY 2', (rank, 0 if crew else 1, gw, gw, rank, 0 if crew else 1, gw, gw)).fetchall()
+        conn.close()
+        return res
+
+    def fetchPages(self, pages, crew = True): # retrieve a few ranking pages at the same time. return page -> page data
+        if len(pages) == 0: return {}
+        pages = list(pages)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(pages), self.max_threads)) as executor:
+            return {p:data for p, data in zip(pages, executor.map(self.requestPage, pages, [crew] * len(pages)))}
+
+    def locate(self, ids, crew = True): # return the last known rank of the given ids (id -> rank), from the history database. the missing ones are searched in a full download of the ranking
+        kind = 0 if crew else 1
+        ranks = {}
+        conn = self.openHistory()
+        for id in ids:
+            r = conn.execute('SELECT rank FROM (SELECT s.ts, e.rank FROM entries e JOIN snapshots s ON s.snapshot = e.snapshot WHERE e.id = ? AND s.kind = ? AND s.gw = ? UNION ALL SELECT ts, rank FROM watch WHERE id = ? AND kind = ? AND gw = ?) ORDER BY ts DESC LIMIT 1', (id, kind, self.gw, id, kind, self.gw)).fetchone()
+            if r is not None: ranks[id] = r[0]
+        conn.close()
+        missing = [id for id in ids if id not in ranks]
+        if len(missing) > 0:
+            print("{} id(s) not in the history database, downloading the whole ranking to find them".format(len(missing)))
+            data = self.requestPage(1, crew)
+            results = [{} for x in range(int(data['count']))]
+            self.storePage(None, results, 1, data['list'], crew)
+            self.scrape(list(range(2, data['last']+1)), results, None, crew)
+            idkey, key = ('id', 'ranking') if crew else ('user_id', 'rank')
+            for r in results:
+                if r.get(idkey) in missing: ranks[r[idkey]] = int(r[key])
+        return ranks
+
+    @stage
+    def watch(self, ids = None, borders = None, crew = True, cycles = 0): # poll only the pages holding the given crews/players (default: the /gbfg/ crews) and border ranks every watch_interval seconds, append their points to the history database. cycles = 0 to run until stopped
+        if self.history_file is None:
+            print("The watch mode needs the history database")
+            return False
+        ids = [str(i) for i in (ids if ids is not None else (self.gbfg_ids if crew else []))]
+        borders = self.watch_borders if borders is None else borders
+        if not self.updateVersion(): return False
+        data = self.firstPage(crew)
+        if data is None or data['count'] == False:
+            print("Can't access the {} ranking".format('crew' if crew else 'player'))
+            return False
+        kind = 0 if crew else 1
+        idkey, key = ('id', 'ranking') if crew else ('user_id', 'rank')
+        ranks = self.locate(ids, crew) # last known rank of the followed ids
+        for id in ids:
+            if id not in ranks: print("'{}' isn't in the ranking, ignored".format(id))
+        count = int(data['count'])
+        size = max(1, len(data['list'])) # rows per page
+        if len(ranks) == 0 and not any(b <= count for b in borders):
+            print("Nothing to watch")
+            return False
+        cycle = 0
+        while cycles == 0 or cycle < cycles:
+            start = time.time()
+            wanted = {(r - 1) // size + 1 for r in borders if r <= count} | {(r - 1) // size + 1 for r in ranks.values()}
+            pages = self.fetchPages(wanted, crew)
+            count = max(int(data['count']) for data in pages.values()) # the ranking grows during the event
+            last = max(data['last'] for data in pages.values())
+            rows = {} # id -> row
+            for data in pages.values():
+                for r in data['list']: rows[r[idkey]] = r
+            # follow the ones which moved: search the neighbour pages, further and further away from their last position
+            for d in range(1, self.watch_search + 1):
+                lost = [id for id in ranks if id not in rows]
+                if len(lost) == 0: break
+                more = set()
+                for id in lost:
+                    p = (ranks[id] - 1) // size + 1
+                    more |= {p - d, p + d}
+                more = {p for p in more if 1 <= p <= last and p not in pages}
+                for p, data in self.fetchPages(more, crew).items():
+                    pages[p] = data
+                    for r in data['list']: rows[r[idkey]] = r
+            ts = int(time.time())
+            followed = [rows[id] for id in ranks if id in rows]
+            by_rank = {int(r[key]):r for r in rows.values()}
+            at_borders = [by_rank[b] for b in borders if b in by_rank]
+            for id in ranks:
+                if id in rows: ranks[id] = int(rows[id][key])
+                else: print("Lost track of '{}', it will be searched again around rank {}".format(id, ranks[id]))
+            try:
+                conn = self.openHistory()
+                with conn:
+                    recorded = {r[idkey]:r for r in followed + at_borders}.values()
+                    conn.execute('INSERT INTO events VALUES (?,?,?) ON CONFLICT(gw) DO UPDATE SET last_seen = excluded.last_seen', (self.gw, ts, ts))
+                    conn.executemany('INSERT INTO entities VALUES (?,?,?) ON CONFLICT(kind, id) DO UPDATE SET name = excluded.name', ((kind, r[idkey], r['name']) for r in recorded))
+                    conn.executemany('INSERT INTO watch VALUES (?,?,?,?,?,?)', ((self.gw, kind, ts, r[idkey], r[key], r['point']) for r in recorded))
+                conn.close()
+            except Exception as e:
+                print('watch(): ' + str(e))
+            print("[{}] {} page(s) polled".format(datetime.fromtimestamp(ts).strftime("%H:%M:%S"), len(pages)))
+            for r in at_borders: print("#{}: {} pts ({})".format(r[key], r['point'], r['name']))
+            for r in sorted(followed, key=lambda r: int(r[key])): print("{} #{}: {} pts".format(r['name'], r[key], r['point']))
+            self.metrics.inc('watch_pages_total', len(pages), endpoint='crew' if crew else 'player')
+            cycle += 1
+            if cycles == 0 or cycle < cycles: time.sleep(max(0, start + self.watch_interval - time.time()))
+
+    @stage
+    def buildAll(self): # compile and build everything, the stages whose inputs didn't change since the last time are skipped (see Pipeline)
         days = ['prelim', 'd1', 'd2', 'd3', 'd4']
-        if mode == 0 or mode == 1:
-            results = {}
-            print("Compiling crew data for GW{}...".format(self.gw)) # crew first
-            for d in days:
-                try:
-                    with open('GW{}_crew_{}.json'.format(self.gw, d)) as f:
-                        data = json.load(f)
-                    for c in data:
-                        if 'id' not in c: continue
-                        if c['id'] not in results: results[c['id']] = {}
-                        results[c['id']][d] = c['point']
-                        results[c['id']]['name'] = c['name']
-                        # we calculate the daily deltas here
-                        if d == 'd1' and 'prelim' in results[c['id']]: results[c['id']]['delta_d1'] = str(int(results[c['id']][d]) - int(results[c['id']]['prelim']))
-                        elif d == 'd2' and 'd1' in results[c['id']]: results[c['id']]['delta_d2'] = str(int(results[c['id']][d]) - int(results[c['id']]['d1']))
-                        elif d == 'd3' and 'd2' in results[c['id']]: results[c['id']]['delta_d3'] = str(int(results[c['id']][d]) - int(results[c['id']]['d2']))
-                        elif d == 'd4' and 'd3' in results[c['id']]: results[c['id']]['delta_d4'] = str(int(results[c['id']][d]) - int(results[c['id']]['d3']))
-                        if d == days[-1]: results[c['id']]['ranking'] = c['ranking']
-                except Exception as e:
-                    print(e)
-            self.writeFile(results, 'GW{}_crew_full.json'.format(self.gw))
-            print("Done, saved to 'GW{}_crew_full.json'".format(self.gw))
+        crew_full, player_full = 'GW{}_crew_full.json'.format(self.gw), 'GW{}_player_full.json'.format(self.gw)
+        def dayFiles():
+            files = []
+            for name in ['GW{}_{}_{}'.format(self.gw, kind, d) for kind in ['crew', 'player'] for d in days]:
+                try: files.append(rankingFile(name))
+                except FileNotFoundError: pass
+            return files
+        def gbfgFiles():
+            return [join('gbfg', f) for f in sorted(listdir('gbfg'))] if os.path.isdir('gbfg') else []
+        def crewCsvs(): # leechlists written by build_crew_list
+            try:
+                with open('gbfg.json') as f:
+                    return [crewCsvName(self.gw, c) for c in json.load(f).values() if 'private' not in c]
+            except FileNotFoundError:
+                return []
+        pipeline = Pipeline('GW{}_pipeline.json'.format(self.gw))
+        pipeline.add('buildGW', self.buildGW, dayFiles, [crew_full, player_full])
+        pipeline.add('makedb', self.makedb, [crew_full, player_full, 'gbfg.json'], ['GW{}.sql'.format(self.gw)], ['buildGW', 'buildGbfgFile'])
+        pipeline.add('downloadGbfg', self.downloadGbfg) # always run, it has its own cache
+        pipeline.add('buildGbfgFile', self.buildGbfgFile, gbfgFiles, ['gbfg.json'], ['downloadGbfg'])
+        pipeline.add('build_crew_list', self.build_crew_list, ['gbfg.json', player_full], crewCsvs, ['buildGW', 'buildGbfgFile'])
+        pipeline.add('build_crew_ranking_list', self.build_crew_ranking_list, ['gbfg.json', crew_full], ['GW{}_Crews.csv'.format(self.gw)], ['buildGW', 'buildGbfgFile'])
+        pipeline.add('build_player_list', self.build_player_list, ['gbfg.json', player_full], ['GW{}_Players.csv'.format(self.gw)], ['buildGW', 'buildGbfgFile'])
+        results = pipeline.run()
+        if any(r[0] in ['failed', 'blocked'] for r in results.values()): return False
+        return results
 
-        if mode == 0 or mode == 2:
+    @stage
+    def buildReports(self, crew = True, hours_left = None): # speed, border and projection reports from the history database (see analytics.py, needs numpy)
+        try:
+            import analytics
+            for name in analytics.report(self.gw, crew, self.history_file, hours_left=hours_left, borders=self.watch_borders, ids=self.gbfg_ids if crew else None):
+                print("{}: Done".format(name))
+        except Exception as e:
+            print('buildReports(): ' + str(e))
+
+    @stage
+    def buildGW(self, mode = 0): # build a .json compiling all the data withing json named with the 'days' suffix. return False if a day file couldn't be read (the missing days are fine, the event isn't over)
+        days = ['prelim', 'd1', 'd2', 'd3', 'd4']
+        ok = True
+        for crew in [True, False]:
+            if mode != 0 and mode != (1 if crew else 2): continue
+            kind = 'crew' if crew else 'player'
+            print("Compiling {} data for GW{}...".format(kind, self.gw))
+            # single pass merge, in any day order. record = [name, level, rank, defeat, day of the name, prelim points, d1 points, ..., d4 points]
+            records = {}
+            def merge(i, rows):
+                for id, point, name, level, rank, defeat in rows:
+                    r = records.get(id)
+                    if r is None:
+                        r = [None, None, None, None, -1] + [None] * len(days)
+                        records[id] = r
+                    if i > r[4]: # the name and level come from the latest day
+                        r[0] = name
+                        r[1] = level
+                        r[4] = i
+                    r[5+i] = point
+                    if i == len(days) - 1: # ranking only comes from the last day
+                        r[2] = rank
+                        r[3] = defeat
+            names = ['GW{}_{}_{}'.format(self.gw, kind, d) for d in days]
+            errors = 0
+            if (os.cpu_count() or 1) > 1: # the day files are parsed in parallel and merged as soon as they are ready, only a day or two are in memory at the same time
+                with concurrent.futures.ProcessPoolExecutor(max_workers=len(days), mp_context=multiprocessing.get_context('spawn')) as executor: # not forked, buildAll runs the stages in threads
+                    futures = {executor.submit(loadDay, name, crew):i for i, name in enumerate(names)}
+                    for future in concurrent.futures.as_completed(futures):
+                        i = futures.pop(future)
+                        day = future.result()
+                        future = None
+                        if isinstance(day, Exception):
+                            print(day)
+                            if not isinstance(day, FileNotFoundError): errors += 1
+                        else: merge(i, day)
+                        day = None
+            else: # streamed, one row at a time
+                for i, name in enumerate(names):
+                    try: merge(i, dayRows(name, crew))
+                    except Exception as e:
+                        print(e)
+                        if not isinstance(e, FileNotFoundError): errors += 1
+            if errors > 0: # the file would be missing a day, and the next build would skip it
+                print("'GW{}_{}_full.json' not saved, {} day file(s) couldn't be read".format(self.gw, kind, errors))
+                ok = False
+                continue
             results = {}
-            print("Compiling player data for GW{}...".format(self.gw)) # player next, exact same thing
-            for d in days:
-                try:
-                    with open('GW{}_player_{}.json'.format(self.gw, d)) as f:
-                        data = json.load(f)
-                    for c in data:
-                        if c['user_id'] not in results: results[c['user_id']] = {}
-                        results[c['user_id']][d] = c['point']
-                        results[c['user_id']]['name'] = c['name']
-                        results[c['user_id']]['level'] = c['level']
-                        if d == 'd1' and 'prelim' in results[c['user_id']]: results[c['user_id']]['delta_d1'] = str(int(results[c['user_id']][d]) - int(results[c['user_id']]['prelim']))
-                        elif d == 'd2' and 'd1' in results[c['user_id']]: results[c['user_id']]['delta_d2'] = str(int(results[c['user_id']][d]) - int(results[c['user_id']]['d1']))
-                        elif d == 'd3' and 'd2' in results[c['user_id']]: results[c['user_id']]['delta_d3'] = str(int(results[c['user_id']][d]) - int(results[c['user_id']]['d2']))
-                        elif d == 'd4' and 'd3' in results[c['user_id']]: results[c['user_id']]['delta_d4'] = str(int(results[c['user_id']][d]) - int(results[c['user_id']]['d3']))
-                        if d == days[-1]:
-                            results[c['user_id']]['defeat'] = c['defeat']
-                            results[c['user_id']]['rank'] = c['rank']
-                except Exception as e:
-                    print(e)
-            self.writeFile(results, 'GW{}_player_full.json'.format(self.gw))
-            print("Done, saved to 'GW{}_player_full.json'".format(self.gw))
+            for id, r in records.items():
+                e = {'name': r[0]}
+                if not crew: e['level'] = r[1]
+                for i, d in enumerate(days):
+                    if r[5+i] is None: continue
+                    e[d] = r[5+i]
+                    if i > 0 and r[4+i] is not None: e['delta_' + d] = r[5+i] - r[4+i] # we calculate the daily deltas here
+                if r[2] is not None:
+                    if crew:
+                        e['ranking'] = r[2]
+                    else:
+                        e['defeat'] = r[3]
+                        e['rank'] = r[2]
+                results[id] = e
+            records = None
+            self.writeFile(results, 'GW{}_{}_full.json'.format(self.gw, kind))
+            print("Done, saved to 'GW{}_{}_full.json'".format(self.gw, kind))
+        if not ok: return False
+
+    def openBulkDb(self, name): # create a temporary sqlite file next to name, tuned for a bulk load (WAL, no fsync, bigger page cache). see swapBulkDb
+        tmp = name + '.tmp'
+        for f in [tmp, tmp + '-wal', tmp + '-shm']: # leftovers of an interrupted build
+            if os.path.exists(f): os.remove(f)
+        conn = sqlite3.connect(tmp)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('PRAGMA cache_size = -65536') # 64 MB
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+
+    def swapBulkDb(self, conn, name): # close a database made by openBulkDb and replace name with it in one rename, the readers of the old file are never blocked and never see a half built one
+        conn.execute('PRAGMA journal_mode = DELETE') # checkpoint the WAL in the file, so it's self contained once renamed (and the readers don't need write access to the folder)
+        conn.close()
+        os.replace(name + '.tmp', name)
 
-    def makedb(self): # make a SQL file (useful for searching the whole thing)
+    @stage
+    def makedb(self): # make a SQL file (useful for searching the whole thing, see queryserver.py). the /gbfg/ member lists are added if 'gbfg.json' exists
         try:
             print("Building Database...")
             try:
@@ -258,24 +1655,46 @@ class Scraper():
                     cdata = json.load(f)
             except Exception as ex:
                 print("Error:", ex)
-                return
-            conn = sqlite3.connect('GW{}.sql'.format(self.gw))
-            c = conn.cursor()
-            c.execute('CREATE TABLE players (rank int, user_id int, name text, level int, defeat int, preliminaries int, interlude_and_day1 int, total_1 int, day_2 int, total_2 int, day_3 int, total_3 int, day_4 int, total_4 int)')
-            for id in pdata:
-                c.execute("INSERT INTO players VALUES ({},{},'{}',{},{},{},{},{},{},{},{},{},{},{})".format(pdata[id].get('rank', 'NULL'), id, pdata[id]['name'].replace("'", "''"), pdata[id]['level'], pdata[id].get('defeat', 'NULL'), pdata[id].get('prelim', 'NULL'), pdata[id].get('delta_d1', 'NULL'), pdata[id].get('d1', 'NULL'), pdata[id].get('delta_d2', 'NULL'), pdata[id].get('d2', 'NULL'), pdata[id].get('delta_d3', 'NULL'), pdata[id].get('d3', 'NULL'), pdata[id].get('delta_d4', 'NULL'), pdata[id].get('d4', 'NULL')))
-            c.execute('CREATE TABLE crews (ranking int, id int, name text, preliminaries int, day1 int, total_1 int, day_2 int, total_2 int, day_3 int, total_3 int, day_4 int, total_4 int)')
-            for id in cdata:
-                c.execute("INSERT INTO crews VALUES ({},{},'{}',{},{},{},{},{},{},{},{},{})".format(cdata[id].get('ranking', 'NULL'), id, cdata[id]['name'].replace("'", "''"), cdata[id].get('prelim', 'NULL'), cdata[id].get('delta_d1', 'NULL'), cdata[id].get('d1', 'NULL'), cdata[id].get('delta_d2', 'NULL'), cdata[id].get('d2', 'NULL'), cdata[id].get('delta_d3', 'NULL'), cdata[id].get('d3', 'NULL'), cdata[id].get('delta_d4', 'NULL'), cdata[id].get('d4', 'NULL')))
-            conn.commit()
-            conn.close()
+                return False
+            try:
+                with open('gbfg.json') as f:
+                    gbfg = json.load(f)
+            except FileNotFoundError:
+                gbfg = {}
+            conn = self.openBulkDb('GW{}.sql'.format(self.gw))
+            with conn: # everything in one transaction
+                c = conn.cursor()
+                c.execute('CREATE TABLE players (rank int, user_id int, name text, level int, defeat int, preliminaries int, interlude_and_day1 int, total_1 int, day_2 int, total_2 int, day_3 int, total_3 int, day_4 int, total_4 int)')
+                c.executemany('INSERT INTO players VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)', ((p.get('rank'), id, p['name'], p['level'], p.get('defeat'), p.get('prelim'), p.get('delta_d1'), p.get('d1'), p.get('delta_d2'), p.get('d2'), p.get('delta_d3'), p.get('d3'), p.get('delta_d4'), p.get('d4')) for id, p in pdata.items()))
+                c.execute('CREATE TABLE crews (ranking int, id int, name text, preliminaries int, day1 int, total_1 int, day_2 int, total_2 int, day_3 int, total_3 int, day_4 int, total_4 int)')
+                c.executemany('INSERT INTO crews VALUES (?,?,?,?,?,?,?,?,?,?,?,?)', ((p.get('ranking'), id, p['name'], p.get('prelim'), p.get('delta_d1'), p.get('d1'), p.get('delta_d2'), p.get('d2'), p.get('delta_d3'), p.get('d3'), p.get('delta_d4'), p.get('d4')) for id, p in cdata.items()))
+                # indexes are built once the tables are filled, it's faster than updating them on every insert
+                c.execute('CREATE INDEX players_user_id ON players (user_id)')
+                c.execute('CREATE INDEX players_rank ON players (rank)')
+                c.execute('CREATE INDEX players_name ON players (name COLLATE NOCASE)')
+                c.execute('CREATE INDEX crews_id ON crews (id)')
+                c.execute('CREATE INDEX crews_ranking ON crews (ranking)')
+                c.execute('CREATE INDEX crews_name ON crews (name COLLATE NOCASE)')
+                c.execute('CREATE TABLE gbfg (id int, name text, private int)')
+                c.executemany('INSERT INTO gbfg VALUES (?,?,?)', ((id, g['name'], int('private' in g)) for id, g in gbfg.items()))
+                c.execute('CREATE TABLE members (crew int, id int, name text, level int, leader int)')
+                c.executemany('INSERT INTO members VALUES (?,?,?,?,?)', ((id, p['id'], p['name'], p['level'], int(p['is_leader'])) for id, g in gbfg.items() if 'private' not in g for p in g['player']))
+                c.execute('CREATE INDEX members_crew ON members (crew)')
+                try: # full-text index of the names, for the prefix searches
+                    for table in ['players', 'crews']:
+                        c.execute("CREATE VIRTUAL TABLE {0}_fts USING fts5(name, content='{0}', prefix='2 3')".format(table))
+                        c.execute("INSERT INTO {0}_fts({0}_fts) VALUES ('rebuild')".format(table))
+                except sqlite3.OperationalError as e: # sqlite built without fts5, the name indexes are used instead
+                    print("No full-text index:", e)
+            self.swapBulkDb(conn, 'GW{}.sql'.format(self.gw))
             print('Done')
             return True
         except Exception as e:
             print('makedb(): ' + str(e))
             return False
 
-    def makebotdb(self, mode = 0): # make a SQL file (useful for searching the whole thing)
+    @stage
+    def makebotdb(self, mode = 0): # make the MizaBOT database. the totals of every day are in player_totals, mode selects the one shown by the players view: 0 = final (ranked players only), 1 = prelim, 2-4 = day 1-3
         try:
             print("Building Database...")
             try:
@@ -285,36 +1704,49 @@ class Scraper():
                     pdata = json.load(f)
             except Exception as ex:
                 print("Error:", ex)
-                return
-            conn = sqlite3.connect('GW.sql')
-            c = conn.cursor()
-            c.execute('CREATE TABLE info (id int, ver int)')
-            c.execute("INSERT INTO info VALUES ({}, 2)".format(self.gw))
-            c.execute('CREATE TABLE crews (ranking int, id int, name text, preliminaries int, total_1 int, total_2 int, total_3 int, total_4 int)')
-            for id in cdata:
-                c.execute("INSERT INTO crews VALUES ({},{},'{}',{},{},{},{},{})".format(cdata[id].get('ranking', 'NULL'), id, cdata[id]['name'].replace("'", "''"), cdata[id].get('prelim', 'NULL'), cdata[id].get('d1', 'NULL'), cdata[id].get('d2', 'NULL'), cdata[id].get('d3', 'NULL'), cdata[id].get('d4', 'NULL')))
-            c.execute('CREATE TABLE players (ranking int, id int, name text, current_total int)')
-            for id in pdata:
-                if mode == 1:
-                    c.execute("INSERT INTO players VALUES ({},{},'{}',{})".format(pdata[id].get('rank', 'NULL'), id, pdata[id]['name'].replace("'", "''"), pdata[id].get('prelim', 'NULL')))
-                elif mode == 2:
-                    c.execute("INSERT INTO players VALUES ({},{},'{}',{})".format(pdata[id].get('rank', 'NULL'), id, pdata[id]['name'].replace("'", "''"), pdata[id].get('d1', 'NULL')))
-                elif mode == 3:
-                    c.execute("INSERT INTO players VALUES ({},{},'{}',{})".format(pdata[id].get('rank', 'NULL'), id, pdata[id]['name'].replace("'", "''"), pdata[id].get('d2', 'NULL')))
-                elif mode == 4:
-                    c.execute("INSERT INTO players VALUES ({},{},'{}',{})".format(pdata[id].get('rank', 'NULL'), id, pdata[id]['name'].replace("'", "''"), pdata[id].get('d3', 'NULL')))
-                elif (mode == 0 and pdata[id].get('rank', 'NULL') != 'NULL'):
-                    c.execute("INSERT INTO players VALUES ({},{},'{}',{})".format(pdata[id].get('rank', 'NULL'), id, pdata[id]['name'].replace("'", "''"), pdata[id].get('d4', 'NULL')))
-            conn.commit()
-            conn.close()
+                return False
+            column = {1:'preliminaries', 2:'total_1', 3:'total_2', 4:'total_3', 0:'total_4'}[mode] # player total shown by the players view
+            conn = self.openBulkDb('GW.sql')
+            with conn:
+                c = conn.cursor()
+                c.execute('CREATE TABLE info (id int, ver int)')
+                c.execute('INSERT INTO info VALUES (?, 2)', (self.gw,))
+                c.execute('CREATE TABLE crews (ranking int, id int, name text, preliminaries int, total_1 int, total_2 int, total_3 int, total_4 int)')
+                c.executemany('INSERT INTO crews VALUES (?,?,?,?,?,?,?,?)', ((p.get('ranking'), id, p['name'], p.get('prelim'), p.get('d1'), p.get('d2'), p.get('d3'), p.get('d4')) for id, p in cdata.items()))
+                c.execute('CREATE TABLE player_totals (ranking int, id int, name text, preliminaries int, total_1 int, total_2 int, total_3 int, total_4 int)') # every day in one pass
+                c.executemany('INSERT INTO player_totals VALUES (?,?,?,?,?,?,?,?)', ((p.get('rank'), id, p['name'], p.get('prelim'), p.get('d1'), p.get('d2'), p.get('d3'), p.get('d4')) for id, p in pdata.items()))
+                c.execute('CREATE VIEW players AS SELECT ranking, id, name, {} AS current_total FROM player_totals{}'.format(column, ' WHERE ranking IS NOT NULL' if mode == 0 else '')) # same columns as the old players table. the final database only has the ranked players
+                c.execute('CREATE INDEX crews_id ON crews (id)')
+                c.execute('CREATE INDEX crews_name ON crews (name COLLATE NOCASE)')
+                c.execute('CREATE INDEX player_totals_id ON player_totals (id)')
+                c.execute('CREATE INDEX player_totals_name ON player_totals (name COLLATE NOCASE)')
+            self.swapBulkDb(conn, 'GW.sql')
             print('Done')
             return True
         except Exception as e:
             print('makebotdb(): ' + str(e))
             return False
 
+    def writeCrewCsvs(self, gbfg, players, ids, temp = None, sort = True): # write the leechlists of the given crews in parallel, one process per crew. return False if one of them failed
+        jobs = []
+        for c in ids: # each worker only gets the data of its crew members
+            members = {}
+            for p in gbfg[c]['player']:
+                if str(p['id']) in players: members[str(p['id'])] = players[str(p['id'])]
+            jobs.append((c, members))
+        if len(jobs) == 0: return
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1), mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(writeCrewCsv, self.gw, c, gbfg[c], members, temp, sort) for c, members in jobs]
+            errors = 0
+            for future in concurrent.futures.as_completed(futures):
+                try: print("{}: Done".format(future.result()))
+                except Exception as e:
+                    print("Error:", e)
+                    errors += 1
+        if errors > 0: return False # an old .csv of the crew would pass for an up to date one
+
+    @stage
     def build_crew_list(self, temp=None): # build the gbfg leechlists on a .csv format
-        remove_punctuation_map = dict((ord(char), None) for char in '\/*?:"<>|')
         try:
             with open('gbfg.json') as f:
                 gbfg = json.load(f)
@@ -322,110 +1754,41 @@ class Scraper():
                 players = json.load(f)
         except Exception as e:
             print("Error:", e)
-            return
-        # one crew by one
-        for c in gbfg:
-            if 'private' in gbfg[c]: continue # ignore private crews
-            with open("GW{}_{}.csv".format(self.gw, gbfg[c]['name'].translate(remove_punctuation_map)), 'w', newline='', encoding="utf-8") as csvfile:
-                llwriter = csv.writer(csvfile, delimiter=',', quotechar='"', lineterminator='\n', quoting=csv.QUOTE_NONNUMERIC)
-                llwriter.writerow(["", "#", "id", "name", "rank", "battle", "preliminaries", "interlude & day 1", "total 1", "day 2", "total 2", "day 3", "total 3", "day 4", "total 4"])
-                l = []
-                for p in gbfg[c]['player']:
-                    if str(p['id']) in players:
-                        if p['is_leader']: players[str(p['id'])]['name'] += " (c)"
-                        l.append(players[str(p['id'])])
-                        l[-1]['id'] = str(p['id'])
-                    else: l.append(p)
-                crew_size = len(l)
-                total = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
-                for i in range(0, crew_size):
-                    if temp is None:
-                        mini = 999999999
-                        idx = -1
-                        for li in range(0, len(l)):
-                            if 'rank' in l[li] and int(l[li]['rank']) <= mini:
-                                mini = int(l[li]['rank'])
-                                idx = li
-                    else:
-                        mini = -1
-                        idx = -1
-                        for li in range(0, len(l)):
-                            if temp in l[li] and int(l[li][temp]) >= mini:
-                                mini = int(l[li][temp])
-                                idx = li
-                    if idx != -1:
-                        pname = l[idx]['name'].replace('"', '\\"')
-                        llwriter.writerow([str(i+1), l[idx].get('rank', 'n/a'), l[idx]['id'], pname, l[idx]['level'], l[idx].get('defeat', 'n/a'), l[idx].get('prelim', 'n/a'), l[idx].get('delta_d1', 'n/a'), l[idx].get('d1', 'n/a'), l[idx].get('delta_d2', 'n/a'), l[idx].get('d2', 'n/a'), l[idx].get('delta_d3', 'n/a'), l[idx].get('d3', 'n/a'), l[idx].get('delta_d4', 'n/a'), l[idx].get('d4', 'n/a')])
-                        total[0] += int(l[idx]['level'])
-                        total[1] += int(l[idx].get('prelim', '0'))
-                        total[2] += int(l[idx].get('delta_d1', '0'))
-                        total[3] += int(l[idx].get('d1', '0'))
-                        total[4] += int(l[idx].get('delta_d2', '0'))
-                        total[5] += int(l[idx].get('d2', '0'))
-                        total[6] += int(l[idx].get('delta_d3', '0'))
-                        total[7] += int(l[idx].get('d3', '0'))
-                        total[8] += int(l[idx].get('delta_d4', '0'))
-                        total[9] += int(l[idx].get('d4', '0'))
-                        l.pop(idx)
-                    else:
-                        pname = l[0]['name'].replace('"', '\\"')
-                        for p in gbfg[c]['player']:
-                            if l[0]['id'] == p['id']:
-                                if p['is_leader']: pname += " (c)"
-                                break
-                        llwriter.writerow([str(i+1), 'n/a', l[0]['id'], pname, l[0]['level'], 'n/a', 'n/a', 'n/a', 'n/a', 'n/a', 'n/a', 'n/a', 'n/a', 'n/a', 'n/a'])
-                        total[0] += int(l[0]['level'])
-                        l.pop(0)
-                llwriter.writerow(['', '', '', 'average', str(total[0]//crew_size), '', '', '', '', '', '', '', '', '', ''])
-                llwriter.writerow(['', '', '', 'total', '', '', str(total[1]), str(total[2]), str(total[3]), str(total[4]), str(total[5]), str(total[6]), str(total[7]), str(total[8]), str(total[9])])
-                llwriter.writerow(['', '', '', '', '', '', '', '', '', '', '', '', '', '', ''])
-                gname = gbfg[c]['name'].replace('"', '\\"')
-                llwriter.writerow(['', 'guild', str(c), gname, '', '', '', '', '', '', '', '', '', '', ''])
-                print("GW{}_{}.csv: Done".format(self.gw, gbfg[c]['name'].translate(remove_punctuation_map)))
+            return False
+        return self.writeCrewCsvs(gbfg, players, [c for c in gbfg if 'private' not in gbfg[c]], temp) # ignore private crews
 
+    @stage
     def build_temp_crew_ranking_list(self): # same thing but while gw is on going (work a bit differently, useful for scouting enemies)
         try:
             with open('GW{}_crew_full.json'.format(self.gw)) as f:
                 crews = json.load(f)
         except Exception as e:
             print("Error:", e)
-            return
+            return False
         with open("GW{}_Crews.csv".format(self.gw), 'w', newline='', encoding="utf-8") as csvfile:
             llwriter = csv.writer(csvfile, delimiter=',', quotechar='"', lineterminator='\n', quoting=csv.QUOTE_NONNUMERIC)
             llwriter.writerow(["", "#", "id", "name", "preliminaries", "day 1", "day 2", "day 3", "day 4", "total"])
-            ranked = []
-            unranked = []
+            rows = []
             for c in self.gbfg_ids:
-                if c in crews:
-                    gname = crews[c]['name'].replace('"', '\\"')
-                    row = [crews[c].get('ranking', 'n/a'), c, gname]
-                    row.append(crews[c].get('prelim', 'n/a'))
-                    row.append(crews[c].get('delta_d1', 'n/a'))
-                    row.append(crews[c].get('delta_d2', 'n/a'))
-                    row.append(crews[c].get('delta_d3', 'n/a'))
-                    row.append(crews[c].get('delta_d4', 'n/a'))
-                    total = max(int(crews[c].get('d4', '0')), int(crews[c].get('prelim', '0'))+int(crews[c].get('delta_d1', '0'))+int(crews[c].get('delta_d2', '0'))+int(crews[c].get('delta_d3', '0'))+int(crews[c].get('delta_d4', '0')))
-                    if total == 0: row.append('n/a')
-                    else: row.append(total)
-                else: continue
-                if row[-1] == 'n/a': unranked.append(row)
-                elif len(ranked) == 0: ranked.append(row)
-                else:
-                    for i in range(0, len(ranked)):
-                        if int(row[-1]) > int(ranked[i][-1]):
-                            ranked.insert(i, row)
-                            break
-                        elif i == len(ranked) -1:
-                            ranked.append(row)
-            ranked.extend(unranked)
-            for i in range(0, len(ranked)):
-                row = [i+1]
-                row.extend(ranked[i])
-                llwriter.writerow(row)
+                if c not in crews: continue
+                gname = crews[c]['name'].replace('"', '\\"')
+                row = [crews[c].get('ranking', 'n/a'), c, gname]
+                row.append(str(crews[c].get('prelim', 'n/a')))
+                row.append(str(crews[c].get('delta_d1', 'n/a')))
+                row.append(str(crews[c].get('delta_d2', 'n/a')))
+                row.append(str(crews[c].get('delta_d3', 'n/a')))
+                row.append(str(crews[c].get('delta_d4', 'n/a')))
+                total = max(int(crews[c].get('d4', '0')), int(crews[c].get('prelim', '0'))+int(crews[c].get('delta_d1', '0'))+int(crews[c].get('delta_d2', '0'))+int(crews[c].get('delta_d3', '0'))+int(crews[c].get('delta_d4', '0')))
+                if total == 0: row.append('n/a')
+                else: row.append(total)
+                rows.append(row)
+            ranked, unranked = rankBy(rows, lambda row: None if row[-1] == 'n/a' else int(row[-1]), True) # highest total first
+            for i, row in enumerate(ranked + unranked):
+                llwriter.writerow([i+1] + row)
             print("GW{}_Crews.csv: Done".format(self.gw))
 
+    @stage
     def build_crew_list_no_sorting(self): # build the (You) leechlist on a .csv format (without sorting)
-        remove_punctuation_map = dict((ord(char), None) for char in '\/*?:"<>|')
         try:
             with open('gbfg.json') as f:
                 gbfg = json.load(f)
@@ -433,43 +1796,10 @@ class Scraper():
                 players = json.load(f)
         except Exception as e:
             print("Error:", e)
-            return
-        # one crew by one
-        for c in gbfg:
-            if c not in ["581111"]: continue
-            if 'private' in gbfg[c]: continue # ignore private crews
-            with open("GW{}_{}.csv".format(self.gw, gbfg[c]['name'].translate(remove_punctuation_map)), 'w', newline='', encoding="utf-8") as csvfile:
-                llwriter = csv.writer(csvfile, delimiter=',', quotechar='"', lineterminator='\n', quoting=csv.QUOTE_NONNUMERIC)
-                llwriter.writerow(["", "#", "id", "name", "rank", "battle", "preliminaries", "interlude & day 1", "total 1", "day 2", "total 2", "day 3", "total 3", "day 4", "total 4"])
-                l = []
-                for p in gbfg[c]['player']:
-                    if str(p['id']) in players:
-                        if p['is_leader']: players[str(p['id'])]['name'] += " (c)"
-                        l.append(players[str(p['id'])])
-                        l[-1]['id'] = str(p['id'])
-                    else: l.append(p)
-                crew_size = len(l)
-                total = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
-                for i in range(0, crew_size):
-                    pname = l[i]['name'].replace('"', '\\"')
-                    llwriter.writerow([str(i+1), l[i].get('rank', 'n/a'), l[i]['id'], pname, l[i]['level'], l[i].get('defeat', 'n/a'), l[i].get('prelim', 'n/a'), l[i].get('delta_d1', 'n/a'), l[i].get('d1', 'n/a'), l[i].get('delta_d2', 'n/a'), l[i].get('d2', 'n/a'), l[i].get('delta_d3', 'n/a'), l[i].get('d3', 'n/a'), l[i].get('delta_d4', 'n/a'), l[i].get('d4', 'n/a')])
-                    total[0] += int(l[i]['level'])
-                    total[1] += int(l[i].get('prelim', '0'))
-                    total[2] += int(l[i].get('delta_d1', '0'))
-                    total[3] += int(l[i].get('d1', '0'))
-                    total[4] += int(l[i].get('delta_d2', '0'))
-                    total[5] += int(l[i].get('d2', '0'))
-                    total[6] += int(l[i].get('delta_d3', '0'))
-                    total[7] += int(l[i].get('d3', '0'))
-                    total[8] += int(l[i].get('delta_d4', '0'))
-                    total[9] += int(l[i].get('d4', '0'))
-                llwriter.writerow(['', '', '', 'average', str(total[0]//crew_size), '', '', '', '', '', '', '', '', '', ''])
-                llwriter.writerow(['', '', '', 'total', '', '', str(total[1]), str(total[2]), str(total[3]), str(total[4]), str(total[5]), str(total[6]), str(total[7]), str(total[8]), str(total[9])])
-                llwriter.writerow(['', '', '', '', '', '', '', '', '', '', '', '', '', '', ''])
-                gname = gbfg[c]['name'].replace('"', '\\"')
-                llwriter.writerow(['', 'guild', str(c), gname, '', '', '', '', '', '', '', '', '', '', ''])
-                print("GW{}_{}.csv: Done".format(self.gw, gbfg[c]['name'].translate(remove_punctuation_map)))
+            return False
+        return self.writeCrewCsvs(gbfg, players, [c for c in gbfg if c in ["581111"] and 'private' not in gbfg[c]], sort=False)
 
+    @stage
     def build_crew_ranking_list(self): # build the ranking of all the gbfg crews
         try:
             with open('gbfg.json') as f:
@@ -478,40 +1808,30 @@ class Scraper():
                 crews = json.load(f)
         except Exception as e:
             print("Error:", e)
-            return
+            return False
         with open("GW{}_Crews.csv".format(self.gw), 'w', newline='', encoding="utf-8") as csvfile:
             llwriter = csv.writer(csvfile, delimiter=',', quotechar='"', lineterminator='\n', quoting=csv.QUOTE_NONNUMERIC)
             llwriter.writerow(["", "#", "id", "name", "preliminaries", "day 1", "day 2", "day 3", "day 4", "final"])
-            ranked = []
-            unranked = []
+            rows = []
             for c in gbfg:
                 gname = gbfg[c]['name'].replace('"', '\\"')
                 row = ['', c, gname]
                 if c in crews:
                     row[0] = crews[c].get('ranking', 'n/a')
-                    row.append(crews[c].get('prelim', 'n/a'))
-                    row.append(crews[c].get('delta_d1', 'n/a'))
-                    row.append(crews[c].get('delta_d2', 'n/a'))
-                    row.append(crews[c].get('delta_d3', 'n/a'))
-                    row.append(crews[c].get('delta_d4', 'n/a'))
-                    row.append(crews[c].get('d4', 'n/a'))
+                    row.append(str(crews[c].get('prelim', 'n/a')))
+                    row.append(str(crews[c].get('delta_d1', 'n/a')))
+                    row.append(str(crews[c].get('delta_d2', 'n/a')))
+                    row.append(str(crews[c].get('delta_d3', 'n/a')))
+                    row.append(str(crews[c].get('delta_d4', 'n/a')))
+                    row.append(str(crews[c].get('d4', 'n/a')))
                 else: row = ['n/a', c, gname, 'n/a', 'n/a', 'n/a', 'n/a', 'n/a', 'n/a']
-                if row[0] == 'n/a': unranked.append(row)
-                elif len(ranked) == 0: ranked.append(row)
-                else:
-                    for i in range(0, len(ranked)):
-                        if int(row[0]) < int(ranked[i][0]):
-                            ranked.insert(i, row)
-                            break
-                        elif i == len(ranked) -1:
-                            ranked.append(row)
-            ranked.extend(unranked)
-            for i in range(0, len(ranked)):
-                row = [i+1]
-                row.extend(ranked[i])
-                llwriter.writerow(row)
+                rows.append(row)
+            ranked, unranked = rankBy(rows, lambda row: None if row[0] == 'n/a' else int(row[0])) # best ranking first
+            for i, row in enumerate(ranked + unranked):
+                llwriter.writerow([i+1] + row)
             print("GW{}_Crews.csv: Done".format(self.gw))
 
+    @stage
     def build_player_list(self):  # build the ranking of all the gbfg players
         try:
             with open('gbfg.json') as f:
@@ -520,52 +1840,74 @@ class Scraper():
                 players = json.load(f)
         except Exception as e:
             print("Error:", e)
-            return
+            return False
         l = []
         for c in gbfg:
             if 'private' in gbfg[c]: continue
             for p in gbfg[c]['player']:
-                if str(p['id']) in players and 'rank' in players[str(p['id'])]:
-                    x = 0
-                    for x in range(0, len(l)):
-                        if 'rank' in l[x] and int(players[str(p['id'])]['rank']) < int(l[x]['rank']):
-                            l.insert(x, players[str(p['id'])])
-                            l[x]['id'] = str(p['id'])
-                            l[x]['guild'] = gbfg[c]['name']
-                            break
-                        elif x == len(l) - 1:
-                            l.append(players[str(p['id'])])
-                            l[-1]['id'] = str(p['id'])
-                            l[-1]['guild'] = gbfg[c]['name']
-                    if len(l) == 0:
-                        l.append(players[str(p['id'])])
-                        l[-1]['id'] = str(p['id'])
-                        l[-1]['guild'] = gbfg[c]['name']
+                data = players.get(str(p['id']))
+                if data is not None and 'rank' in data:
+                    l.append(Member(str(p['id']), data['name'], data['level'], data, gbfg[c]['name']))
+        l, unranked = rankBy(l, lambda m: int(m.data['rank']))
         if len(l) > 0:
             with open("GW{}_Players.csv".format(self.gw), 'w', newline='', encoding="utf-8") as csvfile:
                 llwriter = csv.writer(csvfile, delimiter=',', quotechar='"', lineterminator='\n', quoting=csv.QUOTE_NONNUMERIC)
                 llwriter.writerow(["", "#", "id", "name", "guild", "rank", "battle", "preliminaries", "interlude & day 1", "total 1", "day 2", "total 2", "day 3", "total 3", "day 4", "total 4"])
-                for i in range(0, len(l)):
-                    pname = l[i]['name'].replace('"', '\\"')
-                    gname = l[i]['guild'].replace('"', '\\"')
-                    llwriter.writerow([str(i+1), l[i].get('rank', 'n/a'), l[i]['id'], pname, gname, l[i]['level'], l[i].get('defeat', 'n/a'), l[i].get('prelim', 'n/a'), l[i].get('delta_d1', 'n/a'), l[i].get('d1', 'n/a'), l[i].get('delta_d2', 'n/a'), l[i].get('d2', 'n/a'), l[i].get('delta_d3', 'n/a'), l[i].get('d3', 'n/a'), l[i].get('delta_d4', 'n/a'), l[i].get('d4', 'n/a')])
+                for i, m in enumerate(l):
+                    pname = m.name.replace('"', '\\"')
+                    gname = m.guild.replace('"', '\\"')
+                    d = m.data
+                    llwriter.writerow([str(i+1), d.get('rank', 'n/a'), m.id, pname, gname, m.level, d.get('defeat', 'n/a')] + [str(d.get(k, 'n/a')) for k in ['prelim', 'delta_d1', 'd1', 'delta_d2', 'd2', 'delta_d3', 'd3', 'delta_d4', 'd4']])
             print("GW{}_Players.csv: Done".format(self.gw))
 
+    @stage
     def buildGbfgFile(self): # check the gbfg folder for any json files and fuse the data into one
         # gbfg.json is used in other functions, it contains the crew member lists
+        # the files are applied in timestamp order. the merged ones are recorded in the index, so only the new files are read
         try:
-            files = [f for f in listdir('gbfg') if isfile(join('gbfg', f))]
-            final = {}
-            for fn in files:
-                with open('gbfg/{}'.format(fn)) as f:
-                    content = json.load(f)
-                    for id in content:
-                        if 'private' in content[id] and id in final:
-                            continue
-                        else:
-                            final[id] = content[id]
-            with open('gbfg.json', 'w') as f:
-                json.dump(final, f)
+            index = {'files':{}, 'state':{}}
+            try:
+                with open(self.gbfg_index) as f:
+                    index = json.load(f)
+            except FileNotFoundError:
+                pass
+            stats = {}
+            for fn in listdir('gbfg'):
+                if isfile(join('gbfg', fn)): stats[fn] = os.stat(join('gbfg', fn))
+            order = sorted(stats, key=lambda fn: (dumpTime(fn, stats[fn].st_mtime), fn))
+            known = index['files']
+            rebuild = any(fn not in stats for fn in known) # a merged file was deleted
+            new = []
+            for fn in order:
+                if fn not in known:
+                    new.append(fn)
+                elif known[fn][0] != stats[fn].st_mtime or known[fn][1] != stats[fn].st_size: # touched, check the content
+                    with open(join('gbfg', fn), 'rb') as f:
+                        if hashlib.md5(f.read()).hexdigest() != known[fn][2]: rebuild = True
+                    known[fn][:2] = [stats[fn].st_mtime, stats[fn].st_size]
+            if not rebuild and len(new) > 0 and len(known) > 0: # a new file older than a merged one can't just be applied on top
+                rebuild = dumpTime(new[0], stats[new[0]].st_mtime) < max(dumpTime(fn, known[fn][0]) for fn in known)
+            if rebuild:
+                print("'gbfg' folder changed, merging all the files again")
+                index = {'files':{}, 'state':{}}
+                new = order
+            final = index['state']
+            for fn in new:
+                with open(join('gbfg', fn), 'rb') as f:
+                    raw = f.read()
+                content = json.loads(raw)
+                for id in content:
+                    if 'private' in content[id] and id in final:
+                        continue
+                    else:
+                        final[id] = content[id]
+                index['files'][fn] = [stats[fn].st_mtime, stats[fn].st_size, hashlib.md5(raw).hexdigest()]
+            print("{} file(s) merged".format(len(new)))
+            if len(new) > 0 or not isfile('gbfg.json'):
+                with open('gbfg.json', 'w') as f:
+                    json.dump(final, f)
+            with open(self.gbfg_index, 'w') as f:
+                json.dump(index, f)
             print("Success: 'gbfg.json' created")
             public = len(final)
             for c in final:
@@ -573,79 +1915,121 @@ class Scraper():
             print(public, "/", len(final), "public crew(s)")
         except Exception as e:
             print("Failed: ", e)
+            return False
 
-    def buildRequest(self, url, payload=None): # to request stuff to gbf
-        headers = {'Cookie': self.data['cookie'], 'Referer': 'https://game.granbluefantasy.jp/', 'Origin': 'https://game.granbluefantasy.jp', 'Host': 'game.granbluefantasy.jp', 'User-Agent': self.data['user_agent'], 'X-Requested-With': 'XMLHttpRequest', 'X-VERSION': str(self.version), 'Accept': 'application/json, text/javascript, */*; q=0.01', 'Accept-Encoding': 'gzip, deflate', 'Accept-Language': 'en', 'Connection': 'keep-alive', 'Content-Type': 'application/json'}
+    def buildRequest(self, session, url, payload=None): # to request stuff to gbf
+        headers = session.headers
         if payload is None:
-            response = self.client.get(url, headers=headers)
+            response = session.client.get(url, headers=headers)
         else:
-            response = self.client.post(url, headers=headers, data=payload)
-        if response.status_code != 200: raise Exception()
+            response = session.client.post(url, headers=headers, data=payload)
         return response
 
     def requestCrew(self, id, page): # request a crew info, page 0 = main page, page 1-3 = member pages
         try:
+            session = self.pool.pick()
             ts = int(datetime.now(timezone.utc).replace(tzinfo=None).timestamp() * 1000)
+            start = time.perf_counter()
             if page == 0:
-                req = self.buildRequest("https://game.granbluefantasy.jp/guild_other/guild_info/{}?_={}&t={}&uid={}".format(id, ts, ts+300, self.data['id']))
+                req = self.buildRequest(session, session.guild_info_url.format(id, ts, ts+300))
             else:
-                req = self.buildRequest("https://game.granbluefantasy.jp/guild_other/member_list/{}/{}?_={}&t={}&uid={}".format(page, id, ts, ts+300, self.data['id']))
-            try: self.updateCookie(req.headers['set-cookie'])
-            except: pass
-            return req.json()
+                req = self.buildRequest(session, session.member_list_url.format(page, id, ts, ts+300))
+            return self.readResponse(session, req, 'guild_info' if page == 0 else 'member_list', start)
         except:
+            self.metrics.inc('request_errors_total', endpoint='guild_info' if page == 0 else 'member_list')
             return None
 
-    def downloadGbfg_sub(self, id: int): # subroutine
-        crew = {}
-        data = {}
-        for i in range(0, 4):
-            get = self.requestCrew(id, i)
-            if get is None:
-                if i == 0: print('Crew `{}` not found'.format(id))
-                elif i == 1:
-                    print('Crew `{} {}` is private'.format(id, crew['name']))
-                    crew['private'] = None
-                    data[str(id)] = crew
-                else:
-                    data[str(id)] = crew
-                break
-            else:
-                if i == 0:
-                    crew['name'] = get['guild_name']
-                else:
-                    if 'player' not in crew: crew['player'] = []
-                    for p in get['list']:
-                        crew['player'].append({'id':p['id'], 'name':p['name'], 'level':p['level'], 'is_leader':p['is_leader']})
-                if i == 3:
-                    data[str(id)] = crew
-        return data
+    def downloadGbfg_sub(self, id : int, entry : dict = None): # subroutine. entry is the cache entry of the crew, if any. return (data, new cache entry, changed)
+        pages = {}
+        for attempt in range(3): # no first member page means a private crew, unless the request just failed
+            pages[1] = self.requestCrew(id, 1)
+            if pages[1] is not None: break
+            if attempt < 2: time.sleep(1)
+        if pages[1] is None:
+            info = self.requestCrew(id, 0)
+            if info is None:
+                print('Crew `{}` not found'.format(id))
+                return {}, None, False
+            crew = {'name':info['guild_name'], 'private':None}
+            print('Crew `{} {}` is private'.format(id, crew['name']))
+            return {str(id):crew}, {'time':time.time(), 'crew':crew}, entry is None or 'private' not in entry['crew']
+        last = min(3, int(pages[1].get('last', 3)))
+        revalidate = entry is not None and 'hash' in entry and entry.get('checks', 0) < self.gbfg_checks # the member pages alone can tell if the crew changed, the guild info isn't needed
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor: # the other member pages (and the guild info) at the same time
+            futures = {i:executor.submit(self.requestCrew, id, i) for i in range(0 if not revalidate else 2, last+1) if i not in pages}
+            for i in futures: pages[i] = futures[i].result()
+        complete = all(pages[i] is not None for i in range(2, last+1))
+        h = memberHash([{'count':pages[i].get('count'), 'last':pages[i].get('last'), 'list':pages[i]['list']} for i in range(1, last+1)]) if complete else None
+        if revalidate and h == entry['hash']:
+            return {str(id):entry['crew']}, entry | {'time':time.time(), 'checks':entry.get('checks', 0) + 1}, False
+        if 0 not in pages: pages[0] = self.requestCrew(id, 0)
+        if pages[0] is None:
+            print('Crew `{}` not found'.format(id))
+            return {}, None, False
+        crew = {'name':pages[0]['guild_name'], 'player':[]}
+        for i in range(1, last+1):
+            if pages[i] is None: break
+            for p in pages[i]['list']:
+                crew['player'].append({'id':p['id'], 'name':p['name'], 'level':p['level'], 'is_leader':p['is_leader']})
+        if not complete: return {str(id):crew}, None, True # incomplete, not cached
+        return {str(id):crew}, {'time':time.time(), 'hash':h, 'checks':0, 'crew':crew}, entry is None or entry['crew'] != crew
 
-    def downloadGbfg(self, *ids : int): # download all the gbfg crew member lists and make a json file in the gbfg folder
+    @stage
+    def downloadGbfg(self, *ids : int): # download all the gbfg crew member lists and make a json file in the gbfg folder. the crews given explicitly are always checked, whatever the cache says
+        explicit = len(ids) > 0
         if len(ids) == 0:
             ids = []
             for i in self.gbfg_ids:
                 ids.append(int(i))
         data = {}
-        self.version = self.getGameversion()
-        if self.version is None:
-            print("Impossible to get the game version currently")
-            return
-            
-        with concurrent.futures.ThreadPoolExecutor(max_workers=30) as executor:
-            futures = []
-            for id in ids:
-                futures.append(executor.submit(self.downloadGbfg_sub, id))
-            for future in concurrent.futures.as_completed(futures):
-                r = future.result()
-                if r is not None:
+        cache = {}
+        try:
+            with open(self.gbfg_cache) as f:
+                cache = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print('downloadGbfg(): ' + str(e))
+        now = time.time()
+        fetch = []
+        for id in ids:
+            entry = cache.get(str(id))
+            if entry is not None and not explicit and now - entry['time'] < (self.gbfg_private_ttl if 'private' in entry['crew'] else self.gbfg_ttl):
+                data[str(id)] = entry['crew']
+            else:
+                fetch.append(id)
+        print("{} crew(s) up to date in the cache, {} to check".format(len(ids) - len(fetch), len(fetch)))
+        changed = 0
+        if len(fetch) > 0:
+            if not self.updateVersion(): return False
+            if self.version_cached and self.requestCrew(fetch[0], 0) is None: # the cached version may be outdated
+                print("Checking the game version again...")
+                if not self.updateVersion(True): return False
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=30) as executor:
+                futures = {}
+                for id in fetch:
+                    futures[executor.submit(self.downloadGbfg_sub, id, cache.get(str(id)))] = id
+                for future in concurrent.futures.as_completed(futures):
+                    r, entry, updated = future.result()
                     data = data | r
+                    if entry is not None: cache[str(futures[future])] = entry
+                    if updated: changed += 1
+            print("{} crew(s) changed".format(changed))
+            try:
+                with open(self.gbfg_cache, 'w') as f:
+                    json.dump(cache, f)
+            except Exception as e:
+                print('downloadGbfg(): ' + str(e))
+        if changed == 0 and not explicit and os.path.exists('gbfg') and len(listdir('gbfg')) > 0:
+            print("Nothing changed since the last download, no new file created")
+            return
         if data:
             if not os.path.exists('gbfg'):
                 try: os.makedirs('gbfg')
                 except Exception as e:
                     print("Couldn't create a 'gbfg' directory:", e)
-                    return
+                    return False
             c = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
             try:
                 with open('gbfg/{}.json'.format(c), 'w') as f:
@@ -653,93 +2037,293 @@ class Scraper():
                     print("'gbfg/{}.json' created".format(c))
             except:
                 print("Couldn't create 'gbfg/{}.json'".format(c))
-                return
+                return False
 
-# we start here
-print("GW Ranking Scraper 1.13")
-# gw num
-while True:
+def runShard(path : str): # worker of a sharded scrape (see Scraper.scrapeSharded): retrieve the pages of a shard file in its journal. return the number of pages in the journal
+    with open(path) as f:
+        spec = json.load(f)
+    scraper = Scraper(spec['gw'], spec['host'])
+    scraper.history_file = None
+    scraper.version = spec['version']
+    scraper.pool.setVersion(spec['version'])
+    scraper.engine = spec['engine']
+    stop = Event()
+    def heartbeat(): # touch the .alive file every 10 seconds while we run, the coordinator gives up on a shard without it (see Scraper.shard_timeout)
+        while True:
+            with open(path + '.alive', 'w') as f: f.write(str(time.time()))
+            if stop.wait(10): break
+    Thread(target=heartbeat, daemon=True).start()
     try:
-        i = int(input("Please input the GW number: "))
-        break
-    except:
-        pass
-# init
-try:
-    scraper = Scraper(i)
-except Exception as e:
-    print(e)
-    exit(0)
-# main loop
-while True:
+        journal = scraper.openJournal(spec['journal'], None, spec['crew']) # resume if this shard was already started
+        scraper.scrape([p for p in spec['pages'] if p not in journal.pages], None, journal, spec['crew'])
+        scraper.closeJournal(journal)
+    finally:
+        stop.set()
+    with open(path + '.done', 'w') as f: # tell the coordinator we are done
+        f.write(str(len(journal.pages)))
+    return len(journal.pages)
+
+def gwNumber(value : str): # argparse type of the --gw options
+    try: gw = int(value)
+    except ValueError: raise argparse.ArgumentTypeError("'{}' isn't a number".format(value))
+    if gw < 1 or gw > 999: raise argparse.ArgumentTypeError("the GW number must be between 1 and 999")
+    return gw
+
+def cli(argv : list): # non-interactive entry point, for cron jobs and scripts. return the exit code
+    days = ['prelim', 'd1', 'd2', 'd3']
+    parser = argparse.ArgumentParser(description="GW Ranking Scraper, run without arguments for the interactive menu")
+    parser.add_argument('--dir', help="working directory, with the 'config.json' file (default: the current one)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    gw = argparse.ArgumentParser(add_help=False)
+    gw.add_argument('--gw', type=gwNumber, required=True, help="GW number")
+    gw.add_argument('--host', default="https://game.granbluefantasy.jp")
+    mode = argparse.ArgumentParser(add_help=False)
+    mode.add_argument('--mode', choices=['all', 'crew', 'player'], default='all')
+    p = commands.add_parser('scrape', parents=[gw, mode], help="download the rankings")
+    p.add_argument('--engine', choices=['thread', 'async'])
+    p.add_argument('--output', choices=['json', 'snap', 'ndjson', 'ndjson.gz'])
+    p.add_argument('--shards', type=int, default=0, help="split the download between several processes")
+    p.add_argument('--remote', action='store_true', help="wait for shard workers started by hand")
+    commands.add_parser('compile', parents=[gw, mode], help="compile the day files")
+    commands.add_parser('db', parents=[gw], help="build the database")
+    p = commands.add_parser('botdb', parents=[gw], help="make the MizaBOT database")
+    p.add_argument('--day', choices=days + ['final'], default='final')
+    p = commands.add_parser('lists', parents=[gw], help="build the crew lists")
+    p.add_argument('--day', choices=days, help="build the temporary lists of this day")
+    p.add_argument('--no-sorting', action='store_true')
+    p = commands.add_parser('crew-ranking', parents=[gw], help="build the /gbfg/ crew ranking")
+    p.add_argument('--temp', action='store_true', help="temporary ranking, while the GW is on going")
+    commands.add_parser('player-ranking', parents=[gw], help="build the /gbfg/ player ranking")
+    p = commands.add_parser('gbfg', parents=[gw], help="download the /gbfg/ member lists")
+    p.add_argument('ids', type=int, nargs='*', help="only download these crews")
+    commands.add_parser('merge-gbfg', parents=[gw], help="merge the gbfg/ files")
+    commands.add_parser('all', parents=[gw], help="compile and build all")
+    p = commands.add_parser('history', parents=[gw], help="search the history database")
+    p.add_argument('kind', choices=['crew', 'player'])
+    p.add_argument('id', type=int, nargs='?')
+    p.add_argument('--rank', type=int)
+    p = commands.add_parser('watch', parents=[gw], help="poll the borders and the followed crews or players")
+    p.add_argument('kind', choices=['crew', 'player'])
+    p.add_argument('--borders', type=int, nargs='*')
+    p.add_argument('--ids', type=int, nargs='*')
+    p.add_argument('--interval', type=int, help="seconds between two polls")
+    p.add_argument('--cycles', type=int, default=0, help="number of polls (0 = until stopped)")
+    p = commands.add_parser('reports', parents=[gw], help="speed and projection reports")
+    p.add_argument('kind', choices=['crew', 'player'])
+    p.add_argument('--hours-left', type=float)
+    p = commands.add_parser('serve', parents=[gw], help="HTTP query service over the database (see queryserver.py)")
+    p.add_argument('--port', type=int, default=8080)
+    p = commands.add_parser('convert', help="convert a ranking file to/from .snap")
+    p.add_argument('file')
+    p = commands.add_parser('lookup', help="look up an id, or a rank with --rank, in a .snap file")
+    p.add_argument('file')
+    p.add_argument('key')
+    p.add_argument('--rank', action='store_true')
+    p = commands.add_parser('archive', help="list the snapshots of a .archive file, export one or show the changes between two")
+    p.add_argument('file')
+    p.add_argument('--at', type=int, help="write the ranking at this timestamp in a .json file")
+    p.add_argument('--diff', type=int, nargs=2, metavar='TS', help="print the rows which changed between two timestamps, one json line per row")
+    p = commands.add_parser('shard', help="sharded download worker")
+    p.add_argument('spec')
+    args = parser.parse_args(argv)
+    if args.dir is not None: os.chdir(args.dir)
+    # commands without a scraper
     try:
-        print("\nMain Menu\n[0] Download Crew\n[1] Download Player\n[2] Download All\n[3] Compile Crew Data\n[4] Compile Player Data\n[5] Build Database\n[6] Build Crew Lists\n[7] Build Crew Ranking\n[8] Build Player Ranking\n[9] Compile and Build all\n[10] Advanced\n[Any] Quit")
-        i = input("Input: ")
-        print('')
-        if i == "0": scraper.run(1)
-        elif i == "1": scraper.run(2)
-        elif i == "2": scraper.run(0)
-        elif i == "3": scraper.buildGW(1)
-        elif i == "4": scraper.buildGW(2)
-        elif i == "5": scraper.makedb()
-        elif i == "6": scraper.build_crew_list()
-        elif i == "7": scraper.build_crew_ranking_list()
-        elif i == "8": scraper.build_player_list()
-        elif i == "9":
-            print("[0/6] Compiling Data")
-            scraper.buildGW()
-            print("[1/6] Building a SQL database")
-            scraper.makedb()
-            print("[2/6] Updating /gbfg/ data")
-            scraper.downloadGbfg()
-            scraper.buildGbfgFile()
-            print("[3/6] Building crew .csv files")
-            scraper.build_crew_list()
-            print("[4/6] Building the crew ranking .csv file")
-            scraper.build_crew_ranking_list()
-            print("[5/6] Building the player ranking .csv file")
-            scraper.build_player_list()
-            print("[6/6] Complete")
-        elif i == "10":
-            while True:
-                print("\nAdvanced Menu\n[0] Merge 'gbfg.json' files\n[1] Build Temporary Crew Lists\n[2] Build Temporary /gbfg/ Ranking\n[3] Download /gbfg/ member list\n[4] Download a crew member list\n[5] Make Temporary MizaBOT database\n[6] Make Final MizaBOT database\n[Any] Quit")
-                i = input("Input: ")
-                print('')
-                if i == "0": scraper.buildGbfgFile()
-                elif i == "1":
-                    days = ['prelim', 'd1', 'd2', 'd3']
-                    print("Input the current day (Leave blank to cancel):", days)
-                    i = input("Input: ")
-                    if i == "": pass
-                    elif i not in days: print("Invalid day")
-                    else: scraper.build_crew_list(i)
-                elif i == "2": scraper.build_temp_crew_ranking_list()
-                elif i == "3": scraper.downloadGbfg()
-                elif i == "4":
-                    print("Please input the crew(s) id (Leave blank to cancel)")
-                    i = input("Input: ")
-                    if i == "": pass
-                    else:
-                        try:
-                            i = i.split()
-                            print(i)
-                            l = []
-                            for x in i: l.append(int(x))
-                            print(l)
-                            scraper.downloadGbfg(*l)
-                        except: print("Please input a number")
-                elif i == "5": 
-                    days = ['prelim', 'd1', 'd2', 'd3']
-                    print("Input the current day (Leave blank to cancel):", days)
-                    i = input("Input: ")
-                    if i == "": pass
-                    elif i not in days: print("Invalid day")
-                    else: scraper.makebotdb(days.index(i) + 1)
-                elif i == "6": scraper.makebotdb(0)
-                elif i == "7": scraper.build_crew_list_no_sorting()
-                else: break
-                scraper.save()
-        else: exit(0)
+        if args.command == 'shard':
+            runShard(args.spec)
+            return 0
+        elif args.command == 'convert':
+            print("Done, saved to '{}'".format(convertRanking(args.file)))
+            return 0
+        elif args.command == 'archive':
+            archive = Archive(args.file)
+            if args.at is not None:
+                name = '{}_{}.json'.format(args.file.rsplit('.', 1)[0], args.at)
+                with open(name, 'w') as f:
+                    json.dump(archive.at(args.at), f)
+                print("Done, saved to '{}'".format(name))
+            elif args.diff is not None:
+                for id, old, new in archive.diff(*args.diff): print(json.dumps({'id':id, 'old':old, 'new':new}))
+            else:
+                for ts, kind, offset, length in archive.records: print(ts, datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M"), 'full' if kind == 0 else 'changes', '{} KB'.format(length // 1024))
+            return 0
+        elif args.command == 'lookup':
+            snap = Snapshot(args.file)
+            print(snap.byRank(int(args.key)) if args.rank else snap.byId(args.key))
+            snap.close()
+            return 0
+    except Exception as e:
+        print("Error:", e)
+        return 1
+    scraper = Scraper(args.gw, args.host)
+    modes = {'all':0, 'crew':1, 'player':2}
+    try:
+        if args.command == 'scrape':
+            if args.engine is not None: scraper.engine = args.engine
+            if args.output is not None: scraper.output = args.output
+            r = scraper.run(modes[args.mode], False, args.shards, args.remote)
+        elif args.command == 'compile': r = scraper.buildGW(modes[args.mode])
+        elif args.command == 'db': r = scraper.makedb()
+        elif args.command == 'botdb': r = scraper.makebotdb(0 if args.day == 'final' else days.index(args.day) + 1)
+        elif args.command == 'lists':
+            if args.no_sorting: r = scraper.build_crew_list_no_sorting()
+            else: r = scraper.build_crew_list(args.day)
+        elif args.command == 'crew-ranking': r = scraper.build_temp_crew_ranking_list() if args.temp else scraper.build_crew_ranking_list()
+        elif args.command == 'player-ranking': r = scraper.build_player_list()
+        elif args.command == 'gbfg': r = scraper.downloadGbfg(*args.ids)
+        elif args.command == 'merge-gbfg': r = scraper.buildGbfgFile()
+        elif args.command == 'all': r = scraper.buildAll()
+        elif args.command == 'history':
+            if args.rank is not None:
+                for x in scraper.border(args.rank, args.kind == 'crew', args.gw): print("GW{} {}: #{} {} pts".format(x[0], datetime.fromtimestamp(x[1]).strftime("%Y-%m-%d %H:%M"), x[2], x[3]))
+            elif args.id is not None:
+                for x in scraper.history(args.id, args.kind == 'crew'): print("GW{} {}: rank {} {} pts".format(x[0], datetime.fromtimestamp(x[1]).strftime("%Y-%m-%d %H:%M"), x[2], x[3]))
+            else: parser.error("history needs an id or --rank")
+            r = True
+        elif args.command == 'watch':
+            if args.interval is not None: scraper.watch_interval = args.interval
+            r = scraper.watch(args.ids or None, args.borders or None, args.kind == 'crew', args.cycles)
+        elif args.command == 'reports': r = scraper.buildReports(args.kind == 'crew', args.hours_left)
+        elif args.command == 'serve':
+            import queryserver # only needed here
+            r = queryserver.serve(args.gw, args.port)
     except Exception as e:
         print("Critical error:", e)
-    scraper.save()
\ No newline at end of file
+        r = False
+    scraper.save()
+    return 1 if r is False else 0
+
+if __name__ == "__main__":
+    # we start here
+    if len(sys.argv) > 1: # headless mode, see cli()
+        sys.exit(cli(sys.argv[1:]))
+    print("GW Ranking Scraper 1.13")
+    # gw num
+    while True:
+        try:
+            i = int(input("Please input the GW number: "))
+            break
+        except:
+            pass
+    # init
+    try:
+        scraper = Scraper(i)
+    except Exception as e:
+        print(e)
+        exit(0)
+    # main loop
+    while True:
+        try:
+            print("\nMain Menu\n[0] Download Crew\n[1] Download Player\n[2] Download All\n[3] Compile Crew Data\n[4] Compile Player Data\n[5] Build Database\n[6] Build Crew Lists\n[7] Build Crew Ranking\n[8] Build Player Ranking\n[9] Compile and Build all\n[10] Advanced\n[Any] Quit")
+            i = input("Input: ")
+            print('')
+            if i == "0": scraper.run(1)
+            elif i == "1": scraper.run(2)
+            elif i == "2": scraper.run(0)
+            elif i == "3": scraper.buildGW(1)
+            elif i == "4": scraper.buildGW(2)
+            elif i == "5": scraper.makedb()
+            elif i == "6": scraper.build_crew_list()
+            elif i == "7": scraper.build_crew_ranking_list()
+            elif i == "8": scraper.build_player_list()
+            elif i == "9":
+                scraper.buildAll()
+                print("Complete")
+            elif i == "10":
+                while True:
+                    print("\nAdvanced Menu\n[0] Merge 'gbfg.json' files\n[1] Build Temporary Crew Lists\n[2] Build Temporary /gbfg/ Ranking\n[3] Download /gbfg/ member list\n[4] Download a crew member list\n[5] Make Temporary MizaBOT database\n[6] Make Final MizaBOT database\n[8] Toggle scraping engine (current: {})\n[9] Change the ranking output format (current: {})\n[10] Search the history database\n[11] Sharded download (several processes or hosts)\n[12] Convert a ranking file to/from .snap\n[13] Look up a rank or id in a .snap file\n[14] Watch the borders and the /gbfg/ crews\n[15] Speed and projection reports\n[Any] Quit".format(scraper.engine, scraper.output))
+                    i = input("Input: ")
+                    print('')
+                    if i == "0": scraper.buildGbfgFile()
+                    elif i == "1":
+                        days = ['prelim', 'd1', 'd2', 'd3']
+                        print("Input the current day (Leave blank to cancel):", days)
+                        i = input("Input: ")
+                        if i == "": pass
+                        elif i not in days: print("Invalid day")
+                        else: scraper.build_crew_list(i)
+                    elif i == "2": scraper.build_temp_crew_ranking_list()
+                    elif i == "3": scraper.downloadGbfg()
+                    elif i == "4":
+                        print("Please input the crew(s) id (Leave blank to cancel)")
+                        i = input("Input: ")
+                        if i == "": pass
+                        else:
+                            try:
+                                i = i.split()
+                                print(i)
+                                l = []
+                                for x in i: l.append(int(x))
+                                print(l)
+                                scraper.downloadGbfg(*l)
+                            except: print("Please input a number")
+                    elif i == "5": 
+                        days = ['prelim', 'd1', 'd2', 'd3']
+                        print("Input the current day (Leave blank to cancel):", days)
+                        i = input("Input: ")
+                        if i == "": pass
+                        elif i not in days: print("Invalid day")
+                        else: scraper.makebotdb(days.index(i) + 1)
+                    elif i == "6": scraper.makebotdb(0)
+                    elif i == "7": scraper.build_crew_list_no_sorting()
+                    elif i == "8":
+                        scraper.engine = 'async' if scraper.engine == 'thread' else 'thread'
+                        print("Now using the {} engine".format(scraper.engine))
+                    elif i == "9":
+                        formats = ['json', 'snap', 'ndjson', 'ndjson.gz']
+                        scraper.output = formats[(formats.index(scraper.output) + 1) % len(formats)]
+                        print("Rankings will be saved as .{} files".format(scraper.output))
+                    elif i == "10":
+                        print("Input 'crew' or 'player', followed by an id or by 'rank' and a rank (Leave blank to cancel)")
+                        i = input("Input: ").split()
+                        try:
+                            if len(i) == 0: pass
+                            elif len(i) == 3 and i[1] == 'rank':
+                                for r in scraper.border(int(i[2]), i[0] == 'crew'): print("GW{} {}: #{} {} pts".format(r[0], datetime.fromtimestamp(r[1]).strftime("%Y-%m-%d %H:%M"), r[2], r[3]))
+                            else:
+                                for r in scraper.history(int(i[1]), i[0] == 'crew'): print("GW{} {}: rank {} {} pts".format(r[0], datetime.fromtimestamp(r[1]).strftime("%Y-%m-%d %H:%M"), r[2], r[3]))
+                        except: print("Invalid input")
+                    elif i == "11":
+                        try:
+                            print("Input the mode ([0] All, [1] Crew, [2] Player) and the number of shards, add 'remote' to wait for workers started by hand (Leave blank to cancel)")
+                            i = input("Input: ").split()
+                            if len(i) >= 2: scraper.run(int(i[0]), True, int(i[1]), 'remote' in i)
+                        except ValueError: print("Please input numbers")
+                    elif i == "12":
+                        print("Input the file name, a .snap file is converted back to .json (Leave blank to cancel)")
+                        i = input("Input: ")
+                        try:
+                            if i != "": print("Done, saved to '{}'".format(convertRanking(i)))
+                        except Exception as e: print("Error:", e)
+                    elif i == "13":
+                        print("Input the .snap file name, followed by an id or by 'rank' and a rank (Leave blank to cancel)")
+                        i = input("Input: ").split()
+                        try:
+                            if len(i) == 0: pass
+                            else:
+                                snap = Snapshot(i[0])
+                                print(snap.byRank(int(i[2])) if i[1] == 'rank' else snap.byId(i[1]))
+                                snap.close()
+                        except Exception as e: print("Error:", e)
+                    elif i == "14":
+                        print("Input 'crew' or 'player', followed by the ranks to follow (default: {}), add 'id' and the ids to follow (default: the /gbfg/ crews) (Leave blank to cancel)".format(scraper.watch_borders))
+                        i = input("Input: ").split()
+                        try:
+                            if len(i) > 0:
+                                ids = [int(x) for x in i[i.index('id')+1:]] if 'id' in i else None
+                                borders = [int(x) for x in i[1:i.index('id') if 'id' in i else len(i)]]
+                                print("Polling every {} seconds, press Ctrl+C to stop".format(scraper.watch_interval))
+                                scraper.watch(ids, borders if len(borders) > 0 else None, i[0] == 'crew')
+                        except ValueError: print("Invalid input")
+                    elif i == "15":
+                        print("Input 'crew' or 'player', followed by the number of hours left in the GW to project the finals (optional) (Leave blank to cancel)")
+                        i = input("Input: ").split()
+                        try:
+                            if len(i) > 0: scraper.buildReports(i[0] == 'crew', float(i[1]) if len(i) > 1 else None)
+                        except ValueError: print("Invalid input")
+                    else: break
+                    scraper.save()
+            else: exit(0)
+        except Exception as e:
+            print("Critical error:", e)
+        scraper.save()
\ No newline at end of file
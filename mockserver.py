@@ -0,0 +1,168 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Lock, Thread
+from urllib.parse import urlparse, parse_qs
+import argparse
+import random
+import json
+import time
+import re
+
+# local stand-in of the game server, to test and benchmark the scraper without touching the real game
+# only the endpoints used by gwscrap.py are implemented. usage: Scraper(gw, host="http://127.0.0.1:8000")
+
+class MockServer():
+    def __init__(self, port : int = 8000, crews : int = 10000, players : int = 200000, latency : float = 0.0, jitter : float = 0.5, error_rate : float = 0.0, rate_limit : int = 0, churn : float = 0.0, version : str = "1700000000"):
+        self.port = port
+        self.crews = crews # size of the crew ranking
+        self.players = players # size of the player ranking
+        self.latency = latency # mean delay added to every response, in seconds
+        self.jitter = jitter # latency standard deviation, relative to the latency
+        self.error_rate = error_rate # chance of a response being an error (http 500 or count == false)
+        self.rate_limit = rate_limit # max requests per second and per account (uid) before answering 429 (0 = unlimited)
+        self.churn = churn # rank swaps per second between close neighbours, the rows move between pages like in a live ranking
+        self.version = version
+        self.orders = {'crew':list(range(1, crews+1)), 'player':list(range(1, players+1))} # rank - 1 -> entity, only used with churn
+        self.last_churn = time.time()
+        self.lock = Lock()
+        self.buckets = {} # uid -> (tokens, last refill)
+        self.stats = {'requests':0, 'errors':0, 'limited':0, 'bytes':0}
+        self.routes = [
+            (re.compile(r"^/teamraid(\d{3})/rest/ranking/totalguild/detail/(\d+)/0$"), self.crewRanking),
+            (re.compile(r"^/teamraid(\d{3})/rest_ranking_user/detail/(\d+)/0$"), self.playerRanking),
+            (re.compile(r"^/guild_other/guild_info/(\d+)$"), self.guildInfo),
+            (re.compile(r"^/guild_other/member_list/(\d+)/(\d+)$"), self.memberList),
+        ]
+        self.server = None
+
+    def start(self): # serve in a background thread
+        self.server = MockHTTPServer(('127.0.0.1', self.port), MockHandler)
+        self.server.mock = self
+        self.port = self.server.server_address[1] # in case port 0 was used
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return "http://127.0.0.1:{}".format(self.port)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def allow(self, uid): # token bucket of an account for the rate limit
+        if self.rate_limit <= 0: return True
+        with self.lock:
+            now = time.time()
+            tokens, refill = self.buckets.get(uid, (float(self.rate_limit), now))
+            tokens = min(float(self.rate_limit), tokens + (now - refill) * self.rate_limit)
+            allowed = tokens >= 1
+            self.buckets[uid] = (tokens - 1 if allowed else tokens, now)
+            return allowed
+
+    def count(self, key, n = 1):
+        with self.lock:
+            self.stats[key] += n
+
+    def shuffle(self): # apply the rank swaps since the last call
+        if self.churn <= 0: return
+        with self.lock:
+            now = time.time()
+            swaps = int((now - self.last_churn) * self.churn)
+            if swaps == 0: return
+            self.last_churn = now
+            for order in self.orders.values():
+                for i in range(swaps):
+                    a = random.randrange(len(order))
+                    b = min(len(order) - 1, a + random.randint(1, 10))
+                    order[a], order[b] = order[b], order[a]
+
+    def crewRanking(self, gw, page): # 10 crews per page, like the game
+        page = int(page)
+        rows = []
+        for r in range((page-1)*10+1, min(page*10, self.crews)+1):
+            e = self.orders['crew'][r-1]
+            rows.append({'id':str(500000+e), 'name':'Crew {}'.format(e), 'point':str((self.crews - r + 1) * 1000000), 'ranking':str(r)})
+        return {'count':str(self.crews), 'last':(self.crews + 9) // 10, 'list':rows}
+
+    def playerRanking(self, gw, page):
+        page = int(page)
+        rows = []
+        for r in range((page-1)*10+1, min(page*10, self.players)+1):
+            e = self.orders['player'][r-1]
+            rows.append({'user_id':str(100000+e), 'name':'Player {}'.format(e), 'level':str(100 + e % 200), 'point':str((self.players - r + 1) * 10000), 'rank':str(r), 'defeat':str(e % 500)})
+        return {'count':str(self.players), 'last':(self.players + 9) // 10, 'list':rows}
+
+    def guildInfo(self, id):
+        return {'guild_name':'/gbfg/ crew {}'.format(id)}
+
+    def memberList(self, page, id): # 3 pages of 10 members, the crews with an id multiple of 13 are private
+        if int(id) % 13 == 0: return None
+        rows = []
+        for j in range((int(page)-1)*10, int(page)*10):
+            uid = 100000 + (int(id) * 31 + j * 977) % self.players + 1 # members are taken from the player ranking
+            rows.append({'id':str(uid), 'name':'Player {}'.format(uid - 100000), 'level':str(100 + (uid - 100000) % 200), 'is_leader':j == 0})
+        return {'count':30, 'last':3, 'list':rows}
+
+class MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024 # listen backlog, the default of 5 drops the connections of a burst of workers (1 s SYN retry)
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive
+    disable_nagle_algorithm = True # the headers and the body are two writes, Nagle + delayed ACK would add ~40 ms to every response
+
+    def log_message(self, *args): # silence the default logging
+        pass
+
+    def reply(self, code, body = b'', content_type = 'application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('set-cookie', 'midship={}; path=/; domain=.granbluefantasy.jp'.format(random.randint(0, 99999))) # cookie churn, like the game
+        if random.random() < 0.1: self.send_header('set-cookie', 'wing={}; path=/'.format(random.randint(0, 99999)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.mock.count('bytes', len(body))
+
+    def do_GET(self):
+        mock = self.server.mock
+        mock.count('requests')
+        url = urlparse(self.path)
+        path = url.path
+        if path == '/_stats':
+            with mock.lock: return self.reply(200, json.dumps(mock.stats).encode('utf-8'))
+        if not mock.allow(parse_qs(url.query).get('uid', [''])[0]):
+            mock.count('limited')
+            return self.reply(429)
+        if mock.latency > 0: time.sleep(max(0, random.gauss(mock.latency, mock.latency * mock.jitter)))
+        if path == '/':
+            return self.reply(200, '<html><script>Game.version = "{}";</script></html>'.format(mock.version).encode('utf-8'), 'text/html')
+        for regex, route in mock.routes:
+            m = regex.match(path)
+            if m is None: continue
+            if random.random() < mock.error_rate:
+                mock.count('errors')
+                if random.random() < 0.5 or 'ranking' not in route.__name__.lower(): return self.reply(500)
+                return self.reply(200, b'{"count": false}') # the ranking can also answer without data
+            mock.shuffle()
+            data = route(*m.groups())
+            if data is None: return self.reply(403)
+            return self.reply(200, json.dumps(data).encode('utf-8'))
+        self.reply(404)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in of the GBF ranking and crew endpoints")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--crews', type=int, default=10000, help="number of ranked crews")
+    parser.add_argument('--players', type=int, default=200000, help="number of ranked players")
+    parser.add_argument('--latency', type=float, default=0.0, help="mean response delay, in seconds")
+    parser.add_argument('--jitter', type=float, default=0.5, help="delay standard deviation, relative to the latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="chance of an error response, between 0 and 1")
+    parser.add_argument('--rate-limit', type=int, default=0, help="requests per second and per account before answering 429 (0 = unlimited)")
+    parser.add_argument('--churn', type=float, default=0.0, help="rank swaps per second, to make the rows move between pages")
+    args = parser.parse_args()
+    mock = MockServer(args.port, args.crews, args.players, args.latency, args.jitter, args.error_rate, args.rate_limit, args.churn)
+    mock.start()
+    print("Mock server running on http://127.0.0.1:{} (Ctrl+C to stop)".format(mock.port))
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
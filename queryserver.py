@@ -0,0 +1,223 @@
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+import argparse
+import asyncio
+import sqlite3
+import json
+import time
+import re
+import os
+
+# HTTP query service over the database made by Scraper.makedb (GW{n}.sql), for the crew and player lookups and the leechlists without writing the .csv files
+# everything is read-only, the database can be rebuilt while the service runs (makedb swaps the file in one rename). usage: python queryserver.py --help
+
+DAYS = {'prelim':'preliminaries', 'd1':'total_1', 'd2':'total_2', 'd3':'total_3', 'd4':'total_4'} # day -> column, for the ?day= parameters
+QUERIES = { # the sqlite3 module keeps the compiled statements of the recent queries, they are only prepared once as long as the exact same strings are used
+    'player':'SELECT * FROM players WHERE user_id = ?',
+    'crew':'SELECT * FROM crews WHERE id = ?',
+    'search_player':'SELECT p.* FROM players_fts f JOIN players p ON p.rowid = f.rowid WHERE players_fts MATCH ? ORDER BY p.rank IS NULL, p.rank LIMIT ?',
+    'search_crew':'SELECT c.* FROM crews_fts f JOIN crews c ON c.rowid = f.rowid WHERE crews_fts MATCH ? ORDER BY c.ranking IS NULL, c.ranking LIMIT ?',
+    'search_player_like':'SELECT * FROM players WHERE name LIKE ? ESCAPE \'\\\' OR name LIKE ? ESCAPE \'\\\' ORDER BY rank IS NULL, rank LIMIT ?', # without fts5: the start of the name or of one of its words, like the fts query
+    'search_crew_like':'SELECT * FROM crews WHERE name LIKE ? ESCAPE \'\\\' OR name LIKE ? ESCAPE \'\\\' ORDER BY ranking IS NULL, ranking LIMIT ?',
+    'top_player':'SELECT * FROM players WHERE rank IS NOT NULL ORDER BY rank LIMIT ?',
+    'top_crew':'SELECT * FROM crews WHERE ranking IS NOT NULL ORDER BY ranking LIMIT ?',
+    'gbfg':'SELECT * FROM gbfg WHERE id = ?',
+    'members':'SELECT m.id AS member_id, m.name AS member_name, m.level AS member_level, m.leader, p.* FROM members m LEFT JOIN players p ON p.user_id = m.id WHERE m.crew = ? ORDER BY m.rowid',
+}
+for d, column in DAYS.items(): # ranking by the total of a day
+    QUERIES['top_player_' + d] = 'SELECT * FROM players WHERE {0} IS NOT NULL ORDER BY {0} DESC LIMIT ?'.format(column)
+    QUERIES['top_crew_' + d] = 'SELECT * FROM crews WHERE {0} IS NOT NULL ORDER BY {0} DESC LIMIT ?'.format(column)
+
+class QueryError(Exception): # answered with its http code
+    def __init__(self, code : int, message : str):
+        super().__init__(message)
+        self.code = code
+
+class LRUCache(): # response bodies of the recent requests, emptied when the database changes
+    def __init__(self, size : int):
+        self.size = size
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        body = self.data.get(key)
+        if body is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.data.move_to_end(key)
+        return body
+
+    def put(self, key, body):
+        self.data[key] = body
+        self.data.move_to_end(key)
+        if len(self.data) > self.size: self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+
+class QueryServer():
+    def __init__(self, gw : int, port : int = 8080, cache_size : int = 4096, limit : int = 1000):
+        self.path = 'GW{}.sql'.format(gw)
+        self.port = port
+        self.limit = limit # max rows of a search or top-N answer
+        self.cache = LRUCache(cache_size)
+        self.conn = None
+        self.fts = False # True if the database has the full-text name indexes
+        self.snapshot = None # (inode, mtime, size) of the open database
+        self.checked = 0 # time of the last snapshot check
+        self.routes = [
+            (re.compile(r"^/player/(\d+)$"), self.player),
+            (re.compile(r"^/crew/(\d+)$"), self.crew),
+            (re.compile(r"^/search/(player|crew)$"), self.search),
+            (re.compile(r"^/leechlist/(\d+)$"), self.leechlist),
+            (re.compile(r"^/top/(player|crew)$"), self.top),
+            (re.compile(r"^/_stats$"), self.stats),
+        ]
+        self.server = None
+
+    def refresh(self): # reopen the database if makedb replaced it since the last request, and forget the cached answers
+        now = time.time()
+        if self.conn is not None and now - self.checked < 1: return
+        self.checked = now
+        try: st = os.stat(self.path)
+        except FileNotFoundError: raise QueryError(503, "'{}' not found, build the database first".format(self.path))
+        snapshot = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if snapshot == self.snapshot: return
+        if self.conn is not None: self.conn.close()
+        self.conn = sqlite3.connect('file:{}?mode=ro'.format(self.path), uri=True, cached_statements=len(QUERIES) * 2)
+        self.conn.row_factory = sqlite3.Row
+        self.fts = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'players_fts'").fetchone() is not None
+        self.snapshot = snapshot
+        self.cache.clear()
+
+    def query(self, name, *params): # run one of QUERIES, return the rows as dicts
+        return [dict(row) for row in self.conn.execute(QUERIES[name], params)]
+
+    def intParam(self, params, name, default): # integer query parameter, capped by limit
+        try: return max(1, min(self.limit, int(params.get(name, [default])[0])))
+        except ValueError: raise QueryError(400, "'{}' must be a number".format(name))
+
+    def dayParam(self, params): # optional ?day= parameter
+        day = params.get('day', [None])[0]
+        if day is not None and day not in DAYS: raise QueryError(400, "'day' must be one of {}".format(', '.join(DAYS)))
+        return day
+
+    def player(self, params, id):
+        rows = self.query('player', int(id))
+        if len(rows) == 0: raise QueryError(404, "Player {} not found".format(id))
+        return rows[0]
+
+    def crew(self, params, id):
+        rows = self.query('crew', int(id))
+        if len(rows) == 0: raise QueryError(404, "Crew {} not found".format(id))
+        return rows[0]
+
+    def search(self, params, kind): # names with a word starting with ?q=
+        q = params.get('q', [''])[0].strip()
+        if q == "": raise QueryError(400, "Missing 'q'")
+        n = self.intParam(params, 'n', 20)
+        if self.fts: return self.query('search_' + kind, '"{}"*'.format(q.replace('"', '""')), n)
+        q = re.sub(r'([\\%_])', r'\\\1', q)
+        return self.query('search_{}_like'.format(kind), q + '%', '% ' + q + '%', n)
+
+    def top(self, params, kind): # best ranks, or highest totals of ?day=
+        day = self.dayParam(params)
+        return self.query('top_' + kind + ('' if day is None else '_' + day), self.intParam(params, 'n', 100))
+
+    def leechlist(self, params, id): # same content as the .csv of Scraper.build_crew_list: the members sorted by rank, or by their total of ?day=
+        try: crew = self.query('gbfg', int(id))
+        except sqlite3.OperationalError: raise QueryError(404, "No /gbfg/ data in the database")
+        if len(crew) == 0: raise QueryError(404, "Crew {} isn't a /gbfg/ crew".format(id))
+        if crew[0]['private']: raise QueryError(403, "Crew {} is private".format(id))
+        day = self.dayParam(params)
+        key = 'rank' if day is None else DAYS[day]
+        members = self.query('members', int(id))
+        ranked = [m for m in reversed(members) if m[key] is not None] # tied members come out in reverse order, like in writeCrewCsv (see rankBy)
+        ranked.sort(key=lambda m: m[key], reverse=day is not None)
+        unranked = [m for m in members if m[key] is None]
+        rows = []
+        for i, m in enumerate(ranked + unranked):
+            known = m['user_id'] is not None # in the player data, its name and level are more recent
+            row = {'id':m['member_id'], 'name':(m['name'] if known else m['member_name']) + (" (c)" if m['leader'] else ""), 'level':m['level'] if known else m['member_level']}
+            if i < len(ranked): row.update({k:v for k, v in m.items() if k not in ['user_id', 'name', 'level', 'leader'] and not k.startswith('member_')}) # ranked members get their full data
+            rows.append(row)
+        totals = {c:sum(m[c] or 0 for m in ranked) for c in ['preliminaries', 'interlude_and_day1', 'total_1', 'day_2', 'total_2', 'day_3', 'total_3', 'day_4', 'total_4']}
+        return {'id':int(id), 'name':crew[0]['name'], 'average_level':sum(int(row['level']) for row in rows) // max(1, len(rows)), 'total':totals, 'members':rows}
+
+    def stats(self, params):
+        return {'cache_hits':self.cache.hits, 'cache_misses':self.cache.misses, 'cached':len(self.cache.data), 'fts':self.fts}
+
+    def answer(self, target): # return the http code and the json body of a GET request
+        url = urlparse(target)
+        try:
+            self.refresh()
+            if url.path == '/_stats': return 200, json.dumps(self.stats(None)).encode('utf-8') # never cached
+            body = self.cache.get(target)
+            if body is not None: return 200, body
+            params = parse_qs(url.query)
+            for regex, route in self.routes:
+                m = regex.match(url.path)
+                if m is None: continue
+                body = json.dumps(route(params, *m.groups()), ensure_ascii=False).encode('utf-8')
+                self.cache.put(target, body)
+                return 200, body
+            raise QueryError(404, "Unknown endpoint")
+        except QueryError as e:
+            return e.code, json.dumps({'error':str(e)}).encode('utf-8')
+        except sqlite3.Error as e:
+            print('answer(): ' + str(e))
+            return 500, json.dumps({'error':str(e)}).encode('utf-8')
+
+    async def handle(self, reader, writer): # one client connection, keep-alive
+        try:
+            while True:
+                line = await reader.readline()
+                if not line: break
+                method, target, version = line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in [b'\r\n', b'\n', b'']: break
+                    k, _, v = h.decode('latin-1').partition(':')
+                    headers[k.strip().lower()] = v.strip()
+                if method not in ['GET', 'HEAD']: code, body = 405, b'{"error": "Only GET is supported"}'
+                else: code, body = self.answer(target)
+                keep = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json; charset=utf-8\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'.format(code, STATUS.get(code, ''), len(body), 'keep-alive' if keep else 'close').encode('latin-1'))
+                if method != 'HEAD': writer.write(body)
+                await writer.drain()
+                if not keep: break
+        except (ConnectionError, ValueError): # client gone or malformed request
+            pass
+        finally:
+            writer.close()
+
+    async def start(self): # start listening, return the url
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', self.port)
+        self.port = self.server.sockets[0].getsockname()[1] # in case port 0 was used
+        return "http://127.0.0.1:{}".format(self.port)
+
+    async def serve(self):
+        print("Serving '{}' on {} (Ctrl+C to stop)".format(self.path, await self.start()))
+        async with self.server:
+            await self.server.serve_forever()
+
+STATUS = {200:'OK', 400:'Bad Request', 403:'Forbidden', 404:'Not Found', 405:'Method Not Allowed', 500:'Internal Server Error', 503:'Service Unavailable'}
+
+def serve(gw : int, port : int = 8080, cache_size : int = 4096): # run the service until stopped
+    try:
+        asyncio.run(QueryServer(gw, port, cache_size).serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP query service over GW{n}.sql: /player/<id>, /crew/<id>, /search/player?q=, /search/crew?q=, /leechlist/<crew id>?day=, /top/player?n=&day=, /top/crew?n=&day=")
+    parser.add_argument('gw', type=int)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--cache', type=int, default=4096, help="number of answers kept in memory")
+    parser.add_argument('--dir', help="folder of the database (default: the current one)")
+    args = parser.parse_args()
+    if args.dir is not None: os.chdir(args.dir)
+    serve(args.gw, args.port, args.cache)